@@ -0,0 +1,55 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import FriendShip
+
+User = get_user_model()
+
+
+def profile_key(user_pk):
+    return f"profile:{user_pk}"
+
+
+def get_profile(user_pk):
+    key = profile_key(user_pk)
+    profile = cache.get(key)
+    if profile is None:
+        profile = (
+            User.objects.filter(pk=user_pk)
+            .values(
+                "pk",
+                "username",
+                "follower_count",
+                "following_count",
+                "follow_updated_at",
+            )
+            .first()
+        )
+        if profile is None:
+            return None
+        # be_friends のキーに含めることで、プロフィールと一緒にまとめて無効になる
+        profile["version"] = uuid4().hex
+        cache.set(key, profile, settings.PROFILE_CACHE_TIMEOUT)
+    return profile
+
+
+def be_friends(viewer, profile):
+    key = f"be-friends:{viewer.pk}:{profile['pk']}:{profile['version']}"
+    value = cache.get(key)
+    if value is None:
+        value = FriendShip.objects.filter(
+            follower=viewer, following_id=profile["pk"]
+        ).exists()
+        cache.set(key, value, settings.PROFILE_CACHE_TIMEOUT)
+    return value
+
+
+def invalidate_profiles(*user_pks):
+    keys = [profile_key(pk) for pk in user_pks]
+    cache.delete_many(keys)
+    # コミット前に読まれて古い値がキャッシュされた場合に備えて、コミット後にも消す
+    transaction.on_commit(lambda: cache.delete_many(keys))
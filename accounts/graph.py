@@ -0,0 +1,164 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import FriendShip
+
+FOLLOWING = "following"
+FOLLOWERS = "followers"
+
+
+def contains(ids, value):
+    i = bisect_left(ids, value)
+    return i < len(ids) and ids[i] == value
+
+
+class SocialGraph:
+    # ユーザー id ごとに フォロー中 / フォロワー の id をソート済みの array('q') で持つ
+    # 必要になったときに DB から読み、容量を超えたら使われていないものから捨てる (LRU)
+    # 書き込みは FriendShip のシグナルからコミット後に反映する
+    # 配列はロックの外で読まれるので書き換えず、変更時は新しい配列に差し替える
+
+    def __init__(self, max_bytes=None):
+        self._lock = threading.RLock()
+        self._arrays = OrderedDict()
+        self._loading = {}
+        self._max_bytes = max_bytes
+        self.size = 0
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            return settings.SOCIAL_GRAPH_MAX_BYTES
+        return self._max_bytes
+
+    def following(self, user_pk):
+        return self._get((FOLLOWING, user_pk))
+
+    def followers(self, user_pk):
+        return self._get((FOLLOWERS, user_pk))
+
+    def is_following(self, follower_pk, following_pk):
+        return contains(self.following(follower_pk), following_pk)
+
+    def following_count(self, user_pk):
+        return len(self.following(user_pk))
+
+    def follower_count(self, user_pk):
+        return len(self.followers(user_pk))
+
+    def intersection(self, ids, other_ids):
+        # 短い方の各要素を長い方から二分探索する
+        if len(ids) > len(other_ids):
+            ids, other_ids = other_ids, ids
+        return array("q", (value for value in ids if contains(other_ids, value)))
+
+    def common_following(self, user_pk, other_pk):
+        return self.intersection(self.following(user_pk), self.following(other_pk))
+
+    def page(self, ids, after, size):
+        start = 0 if after is None else bisect_right(ids, after)
+        return ids[start : start + size]
+
+    def add(self, follower_pk, following_pk):
+        with self._lock:
+            self._insert((FOLLOWING, follower_pk), following_pk)
+            self._insert((FOLLOWERS, following_pk), follower_pk)
+
+    def remove(self, follower_pk, following_pk):
+        with self._lock:
+            self._delete((FOLLOWING, follower_pk), following_pk)
+            self._delete((FOLLOWERS, following_pk), follower_pk)
+
+    def clear(self):
+        with self._lock:
+            for key in self._loading:
+                self._mark_dirty(key)
+            self._arrays.clear()
+            self.size = 0
+
+    def _get(self, key):
+        with self._lock:
+            ids = self._arrays.get(key)
+            if ids is not None:
+                self._arrays.move_to_end(key)
+                return ids
+            token = {"dirty": False}
+            self._loading.setdefault(key, []).append(token)
+        try:
+            ids = self._load(key)
+        finally:
+            with self._lock:
+                tokens = self._loading[key]
+                tokens.remove(token)
+                if not tokens:
+                    del self._loading[key]
+        with self._lock:
+            # 読み込み中に書き込みがあった場合は、古いかもしれないので保持しない
+            if not token["dirty"] and key not in self._arrays:
+                self._store(key, ids)
+        return ids
+
+    def _load(self, key):
+        direction, user_pk = key
+        if direction == FOLLOWING:
+            queryset = FriendShip.objects.filter(follower_id=user_pk).values_list(
+                "following_id", flat=True
+            )
+        else:
+            queryset = FriendShip.objects.filter(following_id=user_pk).values_list(
+                "follower_id", flat=True
+            )
+        return array("q", queryset.order_by(queryset._fields[0]))
+
+    def _store(self, key, ids):
+        size = self._bytes(ids)
+        if size > self.max_bytes:
+            return
+        self._arrays[key] = ids
+        self.size += size
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes:
+            _, evicted = self._arrays.popitem(last=False)
+            self.size -= self._bytes(evicted)
+
+    def _insert(self, key, value):
+        self._mark_dirty(key)
+        ids = self._arrays.get(key)
+        if ids is not None and not contains(ids, value):
+            i = bisect_left(ids, value)
+            self._arrays[key] = ids[:i] + array("q", [value]) + ids[i:]
+            self.size += ids.itemsize
+            self._evict()
+
+    def _delete(self, key, value):
+        self._mark_dirty(key)
+        ids = self._arrays.get(key)
+        if ids is not None and contains(ids, value):
+            i = bisect_left(ids, value)
+            self._arrays[key] = ids[:i] + ids[i + 1 :]
+            self.size -= ids.itemsize
+
+    def _mark_dirty(self, key):
+        for token in self._loading.get(key, ()):
+            token["dirty"] = True
+
+    @staticmethod
+    def _bytes(ids):
+        return len(ids) * ids.itemsize
+
+
+social_graph = SocialGraph()
+
+
+def is_following(follower_pk, following_pk):
+    if settings.SOCIAL_GRAPH_ENABLED:
+        return social_graph.is_following(follower_pk, following_pk)
+    return FriendShip.objects.filter(
+        follower_id=follower_pk, following_id=following_pk
+    ).exists()
@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts import suggestions
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Recompute who-to-follow suggestions from FriendShip in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_pk = 0
+        users = 0
+        while True:
+            user_pks = list(
+                User.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not user_pks:
+                break
+            with transaction.atomic():
+                suggestions.rebuild(user_pks)
+            users += len(user_pks)
+            last_pk = user_pks[-1]
+        self.stdout.write(f"Rebuilt suggestions of {users} users.")
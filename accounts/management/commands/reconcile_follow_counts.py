@@ -0,0 +1,64 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.cache import invalidate_profiles
+from accounts.models import FriendShip
+
+User = get_user_model()
+
+
+def count_subquery(field):
+    return Coalesce(
+        Subquery(
+            FriendShip.objects.filter(**{field: OuterRef("pk")})
+            .values(field)
+            .annotate(count=Count("pk"))
+            .values("count")
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = "Recount follower_count/following_count from FriendShip in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_pk = 0
+        fixed = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    User.objects.filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .annotate(
+                        actual_follower=count_subquery("following"),
+                        actual_following=count_subquery("follower"),
+                    )
+                    .values_list(
+                        "pk",
+                        "follower_count",
+                        "following_count",
+                        "actual_follower",
+                        "actual_following",
+                    )[:batch_size]
+                )
+                if not rows:
+                    break
+                stale = [row[0] for row in rows if row[1] != row[3] or row[2] != row[4]]
+                if stale:
+                    fixed += User.objects.filter(pk__in=stale).update(
+                        follower_count=count_subquery("following"),
+                        following_count=count_subquery("follower"),
+                        follow_updated_at=timezone.now(),
+                    )
+                    invalidate_profiles(*stale)
+            last_pk = rows[-1][0]
+        self.stdout.write(f"Reconciled follow counts of {fixed} users.")
@@ -0,0 +1,202 @@
+import random
+from array import array
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import FriendShip
+from tweets import timeline
+from tweets.models import Like, Tweet
+
+User = get_user_model()
+
+WORDS = (
+    "hello world today django python tweet coffee lunch music game "
+    "book movie travel work code test deploy bug fix release weekend"
+).split()
+TAGS = ["django", "python", "music", "travel", "coffee", "news", "games", "food"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, a power-law follow graph, tweets and likes "
+        "for load testing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument(
+            "--follows", type=float, default=20, help="Average follows per user."
+        )
+        parser.add_argument(
+            "--tweets", type=float, default=10, help="Average tweets per user."
+        )
+        parser.add_argument(
+            "--likes", type=float, default=5, help="Average likes per tweet."
+        )
+        parser.add_argument(
+            "--days", type=float, default=30, help="Spread tweets over this many days."
+        )
+        parser.add_argument(
+            "--alpha",
+            type=float,
+            default=1.0,
+            help="Zipf exponent of user popularity.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--prefix", default="seed")
+        parser.add_argument("--password", default="password")
+        parser.add_argument("--skip-suggestions", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["users"] < 2:
+            raise CommandError("--users must be at least 2.")
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.prefix = options["prefix"]
+
+        self.create_users(options["users"], options["password"])
+        # 人気の順位をランダムに割り当て、順位 r のユーザーを 1 / r^alpha の重みで選ぶ
+        self.popular = array("q", self.pks)
+        self.rng.shuffle(self.popular)
+        self.cum_weights = array(
+            "d",
+            accumulate(
+                rank ** -options["alpha"] for rank in range(1, len(self.pks) + 1)
+            ),
+        )
+        self.create_follows(options["follows"])
+        self.create_tweets(options["tweets"], options["likes"], options["days"])
+
+        # bulk_create はシグナルを通らないので、派生データはまとめて作り直す
+        call_command("reconcile_follow_counts", stdout=self.stdout)
+        call_command("backfill_tweet_entities", stdout=self.stdout)
+        if timeline.fanout_enabled():
+            call_command("rebuild_timelines", stdout=self.stdout)
+        if not options["skip_suggestions"]:
+            call_command("rebuild_suggestions", stdout=self.stdout)
+
+    def popular_users(self, k):
+        return self.rng.choices(self.popular, cum_weights=self.cum_weights, k=k)
+
+    def count(self, average, limit):
+        return min(limit, round(self.rng.expovariate(1 / average))) if average else 0
+
+    def write(self, model, objects):
+        with transaction.atomic():
+            model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_users(self, count, password):
+        # ハッシュは重いので全員同じパスワードにする
+        password = make_password(password)
+        self.offset = User.objects.filter(username__startswith=self.prefix).count()
+        last_pk = User.objects.order_by("-pk").values_list("pk", flat=True).first()
+        for start in range(0, count, self.batch_size):
+            self.write(
+                User,
+                [
+                    User(
+                        username=self.username(i),
+                        email=f"{self.username(i)}@example.com",
+                        password=password,
+                    )
+                    for i in range(start, min(count, start + self.batch_size))
+                ],
+            )
+        # i 番目に作ったユーザーの pk
+        self.pks = array(
+            "q",
+            User.objects.filter(pk__gt=last_pk or 0)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+            .iterator(chunk_size=self.batch_size),
+        )
+        self.stdout.write(f"Created {len(self.pks)} users.")
+
+    def username(self, i):
+        return f"{self.prefix}{self.offset + i}"
+
+    def create_follows(self, average):
+        # フォロー数は指数分布、フォロー先は人気に比例して選ぶ (フォロワー数がべき分布になる)
+        limit = (len(self.pks) - 1) // 2
+        batch = []
+        created = 0
+        for follower in self.pks:
+            following = set()
+            for _ in range(self.count(average, limit)):
+                while True:
+                    (candidate,) = self.popular_users(1)
+                    if candidate != follower and candidate not in following:
+                        break
+                following.add(candidate)
+                batch.append(FriendShip(follower_id=follower, following_id=candidate))
+            if len(batch) >= self.batch_size:
+                self.write(FriendShip, batch)
+                created += len(batch)
+                batch = []
+        self.write(FriendShip, batch)
+        created += len(batch)
+        self.stdout.write(f"Created {created} follows.")
+
+    def create_tweets(self, average_tweets, average_likes, days):
+        # よくフォローされるユーザーほどよく投稿する
+        total = round(average_tweets * len(self.pks))
+        tweets = likes = 0
+        start_at = connection.ops.adapt_datetimefield_value(
+            timezone.now().replace(microsecond=0) - timedelta(days=days)
+        )
+        span = round(days * 24 * 60 * 60)
+        for start in range(0, total, self.batch_size):
+            size = min(self.batch_size, total - start)
+            batch = [
+                Tweet(
+                    user_id=author,
+                    content=self.content(),
+                    like_count=self.count(average_likes, len(self.pks)),
+                )
+                for author in self.popular_users(size)
+            ]
+            with transaction.atomic():
+                Tweet.objects.bulk_create(batch)
+                # bulk_create では created_at が全部ほぼ同じ時刻になるので、
+                # i 番目のツイートを days 日前から今までに均等に並べ直す (1 文の UPDATE)
+                # 秒単位にそろえ、20 件に 1 件は前と同じ時刻にする (並び順の同点)
+                offset = batch[0].pk - start
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"""
+                        UPDATE {Tweet._meta.db_table} SET created_at = datetime(
+                            %s,
+                            '+' || (((id - %s) - ((id - %s) %% 20 = 19)) * %s / %s)
+                                || ' seconds'
+                        )
+                        WHERE id BETWEEN %s AND %s
+                        """,
+                        [start_at, offset, offset, span, total]
+                        + [batch[0].pk, batch[-1].pk],
+                    )
+                like_batch = []
+                for tweet in batch:
+                    like_batch += [
+                        Like(user_id=user_id, tweet_id=tweet.pk)
+                        for user_id in self.rng.sample(self.pks, tweet.like_count)
+                    ]
+                Like.objects.bulk_create(like_batch, batch_size=self.batch_size)
+            tweets += len(batch)
+            likes += len(like_batch)
+        self.stdout.write(f"Created {tweets} tweets and {likes} likes.")
+
+    def content(self):
+        words = self.rng.choices(WORDS, k=self.rng.randint(3, 12))
+        if self.rng.random() < 0.2:
+            words.append(f"#{self.rng.choice(TAGS)}")
+        if self.rng.random() < 0.1:
+            words.append(f"@{self.username(self.rng.randrange(len(self.pks)))}")
+        return " ".join(words)[: Tweet._meta.get_field("content").max_length]
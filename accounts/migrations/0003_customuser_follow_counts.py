@@ -0,0 +1,47 @@
+# Generated by Django 4.0.10 on 2026-10-18 15:48
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_follow_counts(apps, schema_editor):
+    CustomUser = apps.get_model("accounts", "CustomUser")
+    FriendShip = apps.get_model("accounts", "FriendShip")
+    follower_counts = (
+        FriendShip.objects.filter(following=OuterRef("pk"))
+        .values("following")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    following_counts = (
+        FriendShip.objects.filter(follower=OuterRef("pk"))
+        .values("follower")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    CustomUser.objects.update(
+        follower_count=Coalesce(Subquery(follower_counts), 0),
+        following_count=Coalesce(Subquery(following_counts), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_friendship_friendship_follow_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_follow_counts, migrations.RunPython.noop),
+    ]
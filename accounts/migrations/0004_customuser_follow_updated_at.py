@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0003_customuser_follow_counts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="follow_updated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
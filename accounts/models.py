@@ -8,6 +8,9 @@ class CustomUser(AbstractUser):
 
     age = models.IntegerField("age", blank=True, null=True)
     email = models.EmailField(unique=True)
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    follow_updated_at = models.DateTimeField(null=True, blank=True)
 
 
 class FriendShip(models.Model):
@@ -28,6 +31,38 @@ class FriendShip(models.Model):
                 fields=["following", "follower"], name="follow_unique"
             ),
         ]
+        indexes = [
+            # follow_unique は (following, follower) 順なので、フォロー中一覧用に逆順も張る
+            models.Index(
+                fields=["follower", "following"], name="friendship_follower_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.follower}follow{self.following}"
+
+
+class Suggestion(models.Model):
+    # user がフォローしている人のうち何人が candidate をフォローしているか (score)
+    user = models.ForeignKey(
+        CustomUser, related_name="suggestions", on_delete=models.CASCADE
+    )
+    candidate = models.ForeignKey(
+        CustomUser, related_name="+", on_delete=models.CASCADE
+    )
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "candidate"], name="suggestion_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-score", "candidate"], name="suggestion_user_score_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user}suggest{self.candidate}"
@@ -0,0 +1,90 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import suggestions
+from .cache import invalidate_profiles
+from .graph import social_graph
+from .models import FriendShip
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=FriendShip)
+def increment_follow_counts(sender, instance, created, **kwargs):
+    if not created:
+        return
+    now = timezone.now()
+    User.objects.filter(pk=instance.follower_id).update(
+        following_count=F("following_count") + 1, follow_updated_at=now
+    )
+    User.objects.filter(pk=instance.following_id).update(
+        follower_count=F("follower_count") + 1, follow_updated_at=now
+    )
+
+
+@receiver(post_delete, sender=FriendShip)
+def decrement_follow_counts(sender, instance, **kwargs):
+    # 0 未満にはせず、フォロー状態が変わったので更新時刻は必ず進める
+    now = timezone.now()
+    User.objects.filter(pk=instance.follower_id).update(
+        following_count=Greatest(F("following_count") - 1, 0), follow_updated_at=now
+    )
+    User.objects.filter(pk=instance.following_id).update(
+        follower_count=Greatest(F("follower_count") - 1, 0), follow_updated_at=now
+    )
+
+
+@receiver(post_save, sender=FriendShip)
+@receiver(post_delete, sender=FriendShip)
+def invalidate_friendship_profiles(sender, instance, **kwargs):
+    invalidate_profiles(instance.follower_id, instance.following_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_profile(sender, instance, **kwargs):
+    invalidate_profiles(instance.pk)
+
+
+@receiver(post_save, sender=FriendShip)
+def add_follow_suggestions(sender, instance, created, **kwargs):
+    if created:
+        suggestions.follow(instance.follower_id, instance.following_id)
+
+
+@receiver(post_delete, sender=FriendShip)
+def remove_follow_suggestions(sender, instance, **kwargs):
+    suggestions.unfollow(instance.follower_id, instance.following_id)
+
+
+@receiver(pre_delete, sender=User)
+def collect_suggestion_followers(sender, instance, **kwargs):
+    # カスケードで消える FriendShip の順序によっては差分更新が合わないので、
+    # このユーザーを経由していたフォロワーの候補は削除後に作り直す
+    instance._suggestion_followers = list(
+        FriendShip.objects.filter(following=instance).values_list("follower", flat=True)
+    )
+
+
+@receiver(post_delete, sender=User)
+def remove_user_suggestions(sender, instance, **kwargs):
+    suggestions.remove_user(instance.pk)
+    suggestions.rebuild(getattr(instance, "_suggestion_followers", []))
+
+
+@receiver(post_save, sender=FriendShip)
+def add_graph_edge(sender, instance, created, **kwargs):
+    if created:
+        follower_pk, following_pk = instance.follower_id, instance.following_id
+        transaction.on_commit(lambda: social_graph.add(follower_pk, following_pk))
+
+
+@receiver(post_delete, sender=FriendShip)
+def remove_graph_edge(sender, instance, **kwargs):
+    follower_pk, following_pk = instance.follower_id, instance.following_id
+    transaction.on_commit(lambda: social_graph.remove(follower_pk, following_pk))
@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+
+from .models import FriendShip, Suggestion
+
+FRIENDSHIP_TABLE = FriendShip._meta.db_table
+SUGGESTION_TABLE = Suggestion._meta.db_table
+
+# score を足し込む upsert。SELECT 側は (user_id, candidate_id, 増分) を返す
+# (SQLite の INSERT ... SELECT ... ON CONFLICT は構文上 WHERE が必須)
+UPSERT_SQL = f"""
+    INSERT INTO {SUGGESTION_TABLE} (user_id, candidate_id, score)
+    {{select}}
+    ON CONFLICT (user_id, candidate_id) DO UPDATE SET score = score + excluded.score
+"""
+
+# user_id がまだフォローしていない candidate_id に限る条件
+NOT_FOLLOWING_SQL = f"""
+    NOT EXISTS (
+        SELECT 1 FROM {FRIENDSHIP_TABLE} g
+        WHERE g.follower_id = {{user}} AND g.following_id = {{candidate}}
+    )
+"""
+
+
+def _execute(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def rebuild(user_pks, batch_size=500):
+    user_pks = list(user_pks)
+    for start in range(0, len(user_pks), batch_size):
+        _rebuild(user_pks[start : start + batch_size])
+
+
+def _rebuild(user_pks):
+    # 友達の友達を JOIN して GROUP BY で数え、user_pks の候補を作り直す
+    Suggestion.objects.filter(user_id__in=user_pks).delete()
+    placeholders = ", ".join(["%s"] * len(user_pks))
+    not_following = NOT_FOLLOWING_SQL.format(
+        user="a.follower_id", candidate="b.following_id"
+    )
+    _execute(
+        f"""
+        INSERT INTO {SUGGESTION_TABLE} (user_id, candidate_id, score)
+        SELECT a.follower_id, b.following_id, COUNT(*)
+        FROM {FRIENDSHIP_TABLE} a
+        JOIN {FRIENDSHIP_TABLE} b ON b.follower_id = a.following_id
+        WHERE a.follower_id IN ({placeholders})
+          AND b.following_id != a.follower_id
+          AND {not_following}
+        GROUP BY a.follower_id, b.following_id
+        """,
+        user_pks,
+    )
+
+
+def follow(follower_pk, following_pk):
+    # follower -> following が増えたときの差分更新
+    Suggestion.objects.filter(user_id=follower_pk, candidate_id=following_pk).delete()
+    # follower: following がフォローしている人が 1 人分有力になる
+    not_following = NOT_FOLLOWING_SQL.format(user="%s", candidate="f.following_id")
+    _execute(
+        UPSERT_SQL.format(select=f"""
+            SELECT %s, f.following_id, 1 FROM {FRIENDSHIP_TABLE} f
+            WHERE f.follower_id = %s AND f.following_id != %s AND {not_following}
+            """),
+        [follower_pk, following_pk, follower_pk, follower_pk],
+    )
+    # follower のフォロワー: following が 1 人分有力になる
+    not_following = NOT_FOLLOWING_SQL.format(user="f.follower_id", candidate="%s")
+    _execute(
+        UPSERT_SQL.format(select=f"""
+            SELECT f.follower_id, %s, 1 FROM {FRIENDSHIP_TABLE} f
+            WHERE f.following_id = %s AND f.follower_id != %s AND {not_following}
+            """),
+        [following_pk, follower_pk, following_pk, following_pk],
+    )
+
+
+def unfollow(follower_pk, following_pk):
+    # follower -> following が消えたときの差分更新 (follow の逆)
+    Suggestion.objects.filter(
+        user_id=follower_pk,
+        candidate__in=FriendShip.objects.filter(follower_id=following_pk).values(
+            "following"
+        ),
+    ).update(score=F("score") - 1)
+    Suggestion.objects.filter(
+        user__in=FriendShip.objects.filter(following_id=follower_pk).values("follower"),
+        candidate_id=following_pk,
+    ).update(score=F("score") - 1)
+    Suggestion.objects.filter(
+        Q(user_id=follower_pk) | Q(candidate_id=following_pk), score__lte=0
+    ).delete()
+    # フォローをやめた相手も、他のフォロー中の人経由でつながっていれば候補に戻す
+    score = FriendShip.objects.filter(
+        follower__in=FriendShip.objects.filter(follower_id=follower_pk).values(
+            "following"
+        ),
+        following_id=following_pk,
+    ).count()
+    if score:
+        Suggestion.objects.update_or_create(
+            user_id=follower_pk, candidate_id=following_pk, defaults={"score": score}
+        )
+
+
+def remove_user(user_pk):
+    # ユーザー削除時の FriendShip の削除で、消えるユーザーへの候補が作られることがある
+    Suggestion.objects.filter(Q(user_id=user_pk) | Q(candidate_id=user_pk)).delete()
+
+
+def get_suggestions(user):
+    # (user, -score, candidate) の索引から上位だけを読むので、フォロー数によらない
+    if not user.is_authenticated:
+        return []
+    return list(
+        Suggestion.objects.filter(user=user)
+        .order_by("-score", "candidate")
+        .values("candidate", "candidate__username", "score")[
+            : settings.SUGGESTION_COUNT
+        ]
+    )
@@ -1,10 +1,30 @@
+import json
+import random
+from datetime import timedelta
+from io import StringIO
+
+from asgiref.sync import sync_to_async
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import SESSION_KEY, get_user_model
 from django.contrib.messages import get_messages
-from django.test import TestCase
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.management import call_command
+from django.db.models import F
+from django.core.handlers.asgi import ASGIHandler
+from django.test import (
+    AsyncClient,
+    AsyncRequestFactory,
+    TestCase,
+    override_settings,
+)
 
 from mysite import settings
-from .models import FriendShip
+from mysite.pagination import CursorPaginator
+from tweets.models import Like, TimelineEntry, Tweet
+from . import views
+from .graph import SocialGraph, social_graph
+from .models import FriendShip, Suggestion
 
 User = get_user_model()
 
@@ -187,7 +207,10 @@ class TestSignUpView(TestCase):
             response_short_password,
             "form",
             "password2",
-            "This password is too short. It must contain at least 8 characters.",
+            [
+                "This password is too short. It must contain at least 8 characters.",
+                "This password is too common.",
+            ],
         )
 
     def test_failure_post_with_password_similar_to_username(self):
@@ -231,7 +254,7 @@ class TestSignUpView(TestCase):
             response_password_only_numbers,
             "form",
             "password2",
-            "This password is entirely numeric.",
+            ["This password is too common.", "This password is entirely numeric."],
         )
 
     def test_failure_post_with_mismatch_password(self):
@@ -271,6 +294,53 @@ class TestHomeView(TestCase):
         self.assertEquals(response_get.status_code, 200)
         self.assertTemplateUsed(response_get, "home.html")
 
+    @override_settings(TIMELINE_PAGE_SIZE=10)
+    def test_success_get_with_cursor(self):
+        # カーソルを辿って全てのツイートを新しい順に重複なく取得
+        tweets = [
+            Tweet.objects.create(user=self.user, content=f"tweet{i}") for i in range(25)
+        ]
+        expected = sorted(tweets, key=lambda t: (t.created_at, t.pk), reverse=True)
+        fetched = []
+        response = self.client.get(reverse("accounts:home"))
+        while True:
+            self.assertEquals(response.status_code, 200)
+            self.assertLessEqual(len(response.context["tweet_list"]), 10)
+            fetched += response.context["tweet_list"]
+            cursor = response.context["next_cursor"]
+            if cursor is None:
+                break
+            response = self.client.get(reverse("accounts:home"), {"cursor": cursor})
+        self.assertEqual(fetched, expected)
+
+    def test_cursor_uses_index_range(self):
+        # 深いページもインデックスを先頭から走査せず、カーソルの位置から範囲検索する
+        tweet = Tweet.objects.create(user=self.user, content="tweet")
+        paginator = CursorPaginator(Tweet.objects.all(), ("-created_at", "-id"), 10)
+        queryset = Tweet.objects.filter(
+            paginator._after([tweet.created_at, tweet.pk])
+        ).order_by("-created_at", "-id")
+        plan = queryset.explain()
+        self.assertIn("SEARCH", plan)
+        self.assertNotIn("SCAN", plan)
+
+    @override_settings(TIMELINE_PAGE_SIZE=10)
+    def test_like_list_scoped_to_page(self):
+        # いいね済みかどうかは表示中のページのツイートだけを調べる
+        tweets = [
+            Tweet.objects.create(user=self.user, content=f"tweet{i}") for i in range(30)
+        ]
+        for tweet in tweets:
+            Like.objects.like(self.user, tweet)
+        response = self.client.get(reverse("accounts:home"))
+        page_ids = {tweet.pk for tweet in response.context["tweet_list"]}
+        self.assertEqual(response.context["like_list"], page_ids)
+
+    def test_failure_get_with_invalid_cursor(self):
+        # 不正なカーソルでリクエストを送信
+        response = self.client.get(reverse("accounts:home"), {"cursor": "invalid"})
+        self.assertEquals(response.status_code, 404)
+
 
 class TestLoginView(TestCase):
     def setUp(self):
@@ -313,7 +383,7 @@ class TestLoginView(TestCase):
         self.assertFormError(
             response_not_exist,
             "form",
-            "",
+            None,
             "Please enter a correct username and password. Note that both fields may be case-sensitive.",
         )
         self.assertNotIn(SESSION_KEY, self.client.session)
@@ -356,8 +426,74 @@ class TestLogoutView(TestCase):
 
 
 class TestUserProfileView(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username="user1",
+            email="test1@example.com",
+            password="pass1111",
+        )
+        self.user2 = User.objects.create_user(
+            username="user2",
+            email="test2@example.com",
+            password="pass2222",
+        )
+        self.client.force_login(self.user1)
+        FriendShip.objects.create(following=self.user2, follower=self.user1)
+
     def test_success_get(self):
-        pass
+        # プロフィールを表示・フォロー数とフォロワー数はカラムから取得
+        response = self.client.get(
+            reverse("accounts:profile", kwargs={"pk": self.user2.pk})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "accounts/profile.html")
+        self.assertEqual(response.context["follower_number"], 1)
+        self.assertEqual(response.context["following_number"], 0)
+        self.assertTrue(response.context["be_friends"])
+
+    def test_failure_get_with_not_exist_user(self):
+        # 存在しないユーザーのプロフィールを表示
+        response = self.client.get(reverse("accounts:profile", kwargs={"pk": 100}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_success_get_from_cache(self):
+        # 2回目以降はキャッシュから表示し、プロフィールのための問い合わせをしない
+        url = reverse("accounts:profile", kwargs={"pk": self.user2.pk})
+        self.client.get(url)
+        # セッションとログインユーザーの取得のみ
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.context["follower_number"], 1)
+        self.assertTrue(response.context["be_friends"])
+
+    def test_invalidate_cache_on_unfollow(self):
+        # フォロー解除でキャッシュが無効になる
+        url = reverse("accounts:profile", kwargs={"pk": self.user2.pk})
+        self.client.get(url)
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "user2"}))
+        response = self.client.get(url)
+        self.assertEqual(response.context["follower_number"], 0)
+        self.assertFalse(response.context["be_friends"])
+
+    def test_not_modified(self):
+        # 変化がなければテンプレートを描画せずに 304 を返す
+        url = reverse("accounts:profile", kwargs={"pk": self.user2.pk})
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # フォロー解除すると 200 を返す
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "user2"}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context["be_friends"])
 
 
 class TestUserProfileEditView(TestCase):
@@ -400,6 +536,10 @@ class TestFollowView(TestCase):
             target_status_code=200,
         )
         self.assertTrue(FriendShip.objects.filter(follower=self.user1).exists)
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 1)
+        self.assertEqual(self.user2.follower_count, 1)
 
     def test_failure_post_with_not_exist_user(self):
         # 存在しないユーザーに対してリクエストを送信
@@ -451,6 +591,10 @@ class TestUnfollowView(TestCase):
             target_status_code=200,
         )
         self.assertEquals(FriendShip.objects.filter(follower=self.user1).count(), 0)
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 0)
+        self.assertEqual(self.user2.follower_count, 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         # 存在しないユーザーに対してリクエストを送信
@@ -505,6 +649,52 @@ class TestFollowingListView(TestCase):
             FriendShip.objects.filter(follower=self.user1).count(),
         )
 
+    @override_settings(FRIENDSHIP_PAGE_SIZE=1)
+    def test_success_get_list(self):
+        # フォロー中のユーザーを pk 順に 1 件ずつ表示する
+        FriendShip.objects.create(following=self.user1, follower=self.user2)
+        url = reverse("accounts:following_list", kwargs={"username": "user1"})
+        # セッション・ログインユーザー・対象ユーザーの pk・一覧 (閲覧者との関係を含む)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.context["following_list"],
+            [
+                {
+                    "pk": self.user2.pk,
+                    "username": "user2",
+                    "you_follow": True,
+                    "follows_you": True,
+                }
+            ],
+        )
+        self.assertContains(response, "Follows you")
+        response = self.client.get(url, {"cursor": response.context["next_cursor"]})
+        self.assertEqual(
+            response.context["following_list"],
+            [
+                {
+                    "pk": self.user3.pk,
+                    "username": "user3",
+                    "you_follow": True,
+                    "follows_you": False,
+                }
+            ],
+        )
+        self.assertIsNone(response.context["next_cursor"])
+
+    def test_failure_get_list(self):
+        response = self.client.get(
+            reverse("accounts:following_list", kwargs={"username": "nobody"})
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse("accounts:following_list", kwargs={"username": "user1"}),
+            {"cursor": "invalid"},
+        )
+        self.assertEqual(response.status_code, 404)
+
 
 class TestFollowerListView(TestCase):
     def setUp(self):
@@ -535,3 +725,483 @@ class TestFollowerListView(TestCase):
             response.context["follower_number"],
             FriendShip.objects.filter(following=self.user1).count(),
         )
+
+    @override_settings(FRIENDSHIP_PAGE_SIZE=1)
+    def test_success_get_list(self):
+        # フォロワーを pk 順に 1 件ずつ表示する
+        FriendShip.objects.create(following=self.user3, follower=self.user1)
+        url = reverse("accounts:follower_list", kwargs={"username": "user1"})
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(
+            response.context["follower_list"],
+            [
+                {
+                    "pk": self.user2.pk,
+                    "username": "user2",
+                    "you_follow": False,
+                    "follows_you": True,
+                }
+            ],
+        )
+        self.assertContains(response, "user2")
+        response = self.client.get(url, {"cursor": response.context["next_cursor"]})
+        self.assertEqual(
+            response.context["follower_list"],
+            [
+                {
+                    "pk": self.user3.pk,
+                    "username": "user3",
+                    "you_follow": True,
+                    "follows_you": True,
+                }
+            ],
+        )
+        self.assertIsNone(response.context["next_cursor"])
+
+
+class TestReconcileFollowCountsCommand(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f"user{i}", email=f"test{i}@example.com")
+            for i in range(3)
+        ]
+        FriendShip.objects.create(following=self.users[0], follower=self.users[1])
+        FriendShip.objects.create(following=self.users[0], follower=self.users[2])
+
+    def test_reconcile(self):
+        # ずれたカウンタを FriendShip の件数に合わせる
+        User.objects.filter(pk=self.users[0].pk).update(follower_count=5)
+        User.objects.filter(pk=self.users[2].pk).update(following_count=0)
+        out = StringIO()
+        call_command("reconcile_follow_counts", batch_size=2, stdout=out)
+        self.assertIn("2 users", out.getvalue())
+        self.assertEqual(
+            [
+                (user.follower_count, user.following_count)
+                for user in User.objects.order_by("pk")
+            ],
+            [(2, 0), (0, 1), (0, 1)],
+        )
+
+
+class TestAsyncFollowView(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username="user1",
+            email="test1@example.com",
+            password="pass1111",
+        )
+        self.user2 = User.objects.create_user(
+            username="user2",
+            email="test2@example.com",
+            password="pass2222",
+        )
+
+    async def post(self, view, username):
+        request = AsyncRequestFactory().post(
+            reverse("accounts:follow", kwargs={"username": username})
+        )
+        request.user = self.user1
+        request.session = {}
+        request._messages = FallbackStorage(request)
+        response = await view.as_view()(request, username=username)
+        return response, [str(message) for message in request._messages]
+
+    async def test_follow_and_unfollow(self):
+        # 非同期ビューでフォロー/フォロー解除する
+        response, messages = await self.post(views.AsyncFollowView, "user2")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(messages, ["You've just followed."])
+        self.assertEqual(
+            await FriendShip.objects.filter(follower=self.user1).acount(), 1
+        )
+        await self.user2.arefresh_from_db()
+        self.assertEqual(self.user2.follower_count, 1)
+
+        response, messages = await self.post(views.AsyncFollowView, "user2")
+        self.assertEqual(messages, ["You have already followed."])
+
+        response, messages = await self.post(views.AsyncUnFollowView, "user2")
+        self.assertEqual(messages, ["You've just unfollowed."])
+        self.assertFalse(await FriendShip.objects.aexists())
+
+    async def test_failure_post_with_self(self):
+        response, messages = await self.post(views.AsyncFollowView, "user1")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(messages, ["You can't follow yourself."])
+        self.assertFalse(await FriendShip.objects.aexists())
+
+
+class TestSuggestion(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f"user{i}", email=f"test{i}@example.com")
+            for i in range(6)
+        ]
+
+    def follow(self, follower, following):
+        FriendShip.objects.get_or_create(
+            follower=self.users[follower], following=self.users[following]
+        )
+
+    def snapshot(self):
+        return set(Suggestion.objects.values_list("user", "candidate", "score"))
+
+    def expected(self):
+        # フォロー中の人が何人その人をフォローしているかを Python で数える
+        following = {user.pk: set() for user in self.users}
+        for follower, followed in FriendShip.objects.values_list(
+            "follower", "following"
+        ):
+            following[follower].add(followed)
+        result = set()
+        for user, followees in following.items():
+            scores = {}
+            for followee in followees:
+                for candidate in following[followee]:
+                    if candidate != user and candidate not in followees:
+                        scores[candidate] = scores.get(candidate, 0) + 1
+            result |= {(user, candidate, score) for candidate, score in scores.items()}
+        return result
+
+    def test_score_by_friends_of_friends(self):
+        self.follow(0, 1)
+        self.follow(0, 2)
+        self.follow(1, 3)
+        self.follow(2, 3)
+        self.follow(2, 4)
+        self.assertEqual(
+            Suggestion.objects.filter(user=self.users[0])
+            .order_by("-score", "candidate")
+            .values_list("candidate", "score")
+            .first(),
+            (self.users[3].pk, 2),
+        )
+        # フォローすると候補から外れる
+        self.follow(0, 3)
+        self.assertFalse(
+            Suggestion.objects.filter(user=self.users[0], candidate=self.users[3])
+        )
+        self.assertEqual(self.snapshot(), self.expected())
+
+    def test_incremental_updates_match_rebuild(self):
+        # フォロー/フォロー解除 を繰り返しても、作り直した結果と一致する
+        rng = random.Random(0)
+        for _ in range(200):
+            follower, following = rng.sample(range(len(self.users)), 2)
+            if rng.random() < 0.6:
+                self.follow(follower, following)
+            else:
+                FriendShip.objects.filter(
+                    follower=self.users[follower], following=self.users[following]
+                ).delete()
+            self.assertEqual(self.snapshot(), self.expected())
+        call_command("rebuild_suggestions", batch_size=4, stdout=StringIO())
+        self.assertEqual(self.snapshot(), self.expected())
+
+    def test_delete_user(self):
+        self.follow(0, 1)
+        self.follow(0, 2)
+        self.follow(1, 3)
+        self.follow(2, 3)
+        self.follow(3, 1)
+        self.users[3].delete()
+        self.assertEqual(self.snapshot(), self.expected())
+
+    def test_home_shows_suggestions(self):
+        self.follow(0, 1)
+        self.follow(0, 2)
+        self.follow(1, 3)
+        self.follow(2, 3)
+        self.follow(1, 4)
+        self.client.force_login(self.users[0])
+        response = self.client.get(reverse("accounts:home"))
+        self.assertEqual(
+            [
+                (suggestion["candidate__username"], suggestion["score"])
+                for suggestion in response.context["suggestions"]
+            ],
+            [("user3", 2), ("user4", 1)],
+        )
+        self.assertContains(response, "Who to follow")
+
+
+class TestSocialGraph(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f"user{i}", email=f"test{i}@example.com")
+            for i in range(5)
+        ]
+        social_graph.clear()
+        self.addCleanup(social_graph.clear)
+
+    def follow(self, follower, following):
+        with self.captureOnCommitCallbacks(execute=True):
+            FriendShip.objects.create(
+                follower=self.users[follower], following=self.users[following]
+            )
+
+    def unfollow(self, follower, following):
+        with self.captureOnCommitCallbacks(execute=True):
+            FriendShip.objects.filter(
+                follower=self.users[follower], following=self.users[following]
+            ).delete()
+
+    def pks(self, *indexes):
+        return [self.users[i].pk for i in indexes]
+
+    def test_lookups(self):
+        self.follow(0, 3)
+        self.follow(0, 1)
+        self.follow(2, 1)
+        self.follow(2, 3)
+        graph = SocialGraph(max_bytes=1024)
+        user0, user1, user2, user3, _ = self.pks(0, 1, 2, 3, 4)
+        self.assertEqual(list(graph.following(user0)), [user1, user3])
+        self.assertEqual(list(graph.followers(user1)), [user0, user2])
+        self.assertTrue(graph.is_following(user0, user1))
+        self.assertFalse(graph.is_following(user1, user0))
+        self.assertEqual(graph.following_count(user2), 2)
+        self.assertEqual(graph.follower_count(user0), 0)
+        self.assertEqual(list(graph.common_following(user0, user2)), [user1, user3])
+        # 2 回目以降は DB を読まない
+        with self.assertNumQueries(0):
+            graph.following(user0)
+
+    def test_signals_update_cached_arrays(self):
+        self.follow(0, 1)
+        user0, user1, user2 = self.pks(0, 1, 2)
+        self.assertEqual(list(social_graph.following(user0)), [user1])
+        self.assertEqual(list(social_graph.followers(user1)), [user0])
+        self.follow(0, 2)
+        self.unfollow(0, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(list(social_graph.following(user0)), [user2])
+            self.assertEqual(list(social_graph.followers(user1)), [])
+
+    def test_evicts_least_recently_used(self):
+        for following in range(1, 5):
+            self.follow(0, following)
+        self.follow(1, 0)
+        user0, user1, user2 = self.pks(0, 1, 2)
+        # 8 バイトの id が 5 個分まで
+        graph = SocialGraph(max_bytes=40)
+        graph.following(user0)
+        graph.following(user1)
+        self.assertEqual(graph.size, 40)
+        graph.following(user0)
+        graph.followers(user2)
+        # 一番使われていない user1 のフォロー中から捨てる
+        self.assertEqual(graph.size, 40)
+        with self.assertNumQueries(0):
+            graph.following(user0)
+            graph.followers(user2)
+        with self.assertNumQueries(1):
+            graph.following(user1)
+
+    def test_writes_replace_arrays(self):
+        # 読み手が持っている配列は書き換えない
+        self.follow(0, 2)
+        user0, user1, user2, user3 = self.pks(0, 1, 2, 3)
+        following = social_graph.following(user0)
+        self.follow(0, 1)
+        self.follow(0, 3)
+        self.unfollow(0, 2)
+        self.assertEqual(list(following), [user2])
+        self.assertEqual(list(social_graph.following(user0)), [user1, user3])
+
+    def test_evicts_after_insert(self):
+        self.follow(0, 1)
+        self.follow(1, 2)
+        user0, user1 = self.pks(0, 1)
+        graph = SocialGraph(max_bytes=16)
+        graph.following(user0)
+        graph.following(user1)
+        self.assertEqual(graph.size, 16)
+        # 追加で上限を超えたら古いものから捨てる
+        graph.add(user1, self.users[3].pk)
+        self.assertEqual(graph.size, 16)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(graph.following(user1)), 2)
+        with self.assertNumQueries(1):
+            graph.following(user0)
+
+    def test_skips_arrays_over_limit(self):
+        for following in range(1, 5):
+            self.follow(0, following)
+        graph = SocialGraph(max_bytes=16)
+        self.assertEqual(len(graph.following(self.users[0].pk)), 4)
+        self.assertEqual(graph.size, 0)
+
+    @override_settings(SOCIAL_GRAPH_ENABLED=True, FRIENDSHIP_PAGE_SIZE=2)
+    def test_following_list(self):
+        for following in range(1, 5):
+            self.follow(0, following)
+        self.follow(3, 0)
+        self.client.force_login(self.users[0])
+        url = reverse("accounts:following_list", kwargs={"username": "user0"})
+        response = self.client.get(url)
+        self.assertEqual(
+            response.context["following_list"],
+            [
+                {
+                    "pk": self.users[1].pk,
+                    "username": "user1",
+                    "you_follow": True,
+                    "follows_you": False,
+                },
+                {
+                    "pk": self.users[2].pk,
+                    "username": "user2",
+                    "you_follow": True,
+                    "follows_you": False,
+                },
+            ],
+        )
+        # 2 ページ目はグラフを使わない場合と同じカーソルで取れる
+        cursor = response.context["next_cursor"]
+        with override_settings(SOCIAL_GRAPH_ENABLED=False):
+            expected = self.client.get(url, {"cursor": cursor}).context
+        # セッション・ログインユーザー・対象ユーザーの pk・ユーザー名
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {"cursor": cursor})
+        self.assertEqual(response.context["following_list"], expected["following_list"])
+        self.assertIsNone(response.context["next_cursor"])
+        self.assertTrue(response.context["following_list"][0]["follows_you"])
+
+        response = self.client.get(url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(SOCIAL_GRAPH_ENABLED=True)
+    def test_follow_and_profile(self):
+        self.client.force_login(self.users[0])
+        url = reverse("accounts:follow", kwargs={"username": "user1"})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url)
+        response = self.client.post(url)
+        self.assertIn(
+            "You have already followed.",
+            [str(message) for message in get_messages(response.wsgi_request)],
+        )
+        response = self.client.get(
+            reverse("accounts:profile", kwargs={"pk": self.users[1].pk})
+        )
+        self.assertTrue(response.context["be_friends"])
+
+
+class TestSeedCommand(TestCase):
+    def seed(self):
+        call_command(
+            "seed",
+            users=30,
+            follows=4,
+            tweets=3,
+            likes=2,
+            batch_size=7,
+            stdout=StringIO(),
+        )
+        return (
+            set(
+                FriendShip.objects.values_list(
+                    "follower__username", "following__username"
+                )
+            ),
+            list(Tweet.objects.order_by("pk").values_list("user__username", "content")),
+        )
+
+    def test_spread_created_at(self):
+        # 投稿時刻は --days の範囲に pk 順で散らばる
+        self.seed()
+        created_at = list(
+            Tweet.objects.order_by("pk").values_list("created_at", flat=True)
+        )
+        self.assertEqual(created_at, sorted(created_at))
+        self.assertGreater(created_at[-1] - created_at[0], timedelta(days=7))
+        self.assertLess(timezone.now() - created_at[0], timedelta(days=31))
+        self.assertGreater(len(set(created_at)), len(created_at) // 2)
+        # 同じ時刻の投稿もある
+        self.assertLess(len(set(created_at)), len(created_at))
+
+    @override_settings(HOME_TIMELINE_ENGINE="fanout")
+    def test_fanout_timelines(self):
+        # fanout エンジンのときは本人とフォロワーのタイムラインも作る
+        self.seed()
+        self.assertEqual(
+            TimelineEntry.objects.count(),
+            sum(
+                1 + FriendShip.objects.filter(following_id=tweet.user_id).count()
+                for tweet in Tweet.objects.all()
+            ),
+        )
+
+    def test_seed(self):
+        follows, tweets = self.seed()
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(len(tweets), 90)
+        self.assertTrue(follows)
+        # 件数の列はシグナルを通したときと同じになる
+        for user in User.objects.all():
+            self.assertEqual(
+                user.follower_count, FriendShip.objects.filter(following=user).count()
+            )
+            self.assertEqual(
+                user.following_count, FriendShip.objects.filter(follower=user).count()
+            )
+        for tweet in Tweet.objects.all():
+            self.assertEqual(tweet.like_count, Like.objects.filter(tweet=tweet).count())
+        self.assertFalse(FriendShip.objects.filter(follower=F("following")))
+        self.assertTrue(Suggestion.objects.exists())
+
+    def test_same_seed_same_data(self):
+        first = self.seed()
+        User.objects.all().delete()
+        self.assertEqual(self.seed(), first)
+
+
+class TestQueryTimingMiddleware(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="user1", email="test1@example.com", password="pass1111"
+        )
+        self.client.force_login(self.user)
+        self.url = reverse("accounts:profile", kwargs={"pk": self.user.pk})
+
+    @override_settings(SQL_TIMING_SAMPLE_RATE=1.0)
+    def test_sampled(self):
+        with self.assertLogs("mysite.middleware", "INFO") as logs:
+            response = self.client.get(self.url)
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="\d+ queries", db-slowest;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["view"], "accounts:profile")
+        self.assertEqual(record["status"], 200)
+        # セッション・ログインユーザー・プロフィール・フォロー状態
+        self.assertEqual(record["queries"], 4)
+        self.assertIn("SELECT", record["slowest_sql"])
+        self.assertIn(f'"{record["queries"]} queries"', response["Server-Timing"])
+
+    def test_not_sampled(self):
+        # 既定では計測しない
+        response = self.client.get(self.url)
+        self.assertNotIn("Server-Timing", response)
+
+    @override_settings(DEBUG=True)
+    def test_asgi_handler_not_adapted(self):
+        # ASGI で同期/非同期の変換を挟まない (DEBUG のときだけ変換がログに出る)
+        with self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler()
+
+    @override_settings(SQL_TIMING_SAMPLE_RATE=1.0)
+    async def test_sampled_async(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user)
+        with self.assertLogs("mysite.middleware", "INFO") as logs:
+            response = await client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        # ビューを実行したスレッドのクエリも数える
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["queries"], 4)
+        self.assertIn('"4 queries"', response["Server-Timing"])
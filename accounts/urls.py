@@ -1,7 +1,13 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
+if settings.ASYNC_VIEWS:
+    FollowView, UnFollowView = views.AsyncFollowView, views.AsyncUnFollowView
+else:
+    FollowView, UnFollowView = views.FollowView, views.UnFollowView
+
 app_name = "accounts"
 urlpatterns = [
     path("signup/", views.SignupView.as_view(), name="signup"),
@@ -9,8 +15,8 @@ urlpatterns = [
     path("login/", views.LoginView.as_view(), name="login"),
     path("logout/", views.LogoutView.as_view(), name="logout"),
     path("profile/<int:pk>/", views.ProfileView.as_view(), name="profile"),
-    path("<str:username>/follow/", views.FollowView.as_view(), name="follow"),
-    path("<str:username>/unfollow/", views.UnFollowView.as_view(), name="unfollow"),
+    path("<str:username>/follow/", FollowView.as_view(), name="follow"),
+    path("<str:username>/unfollow/", UnFollowView.as_view(), name="unfollow"),
     path(
         "<str:username>/following_list/",
         views.FollowingListView.as_view(),
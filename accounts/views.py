@@ -1,8 +1,12 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
-from django.shortcuts import get_object_or_404
 from django.contrib.auth import authenticate, login, get_user_model
 from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.views import View
 from django.views.generic import (
     CreateView,
     TemplateView,
@@ -12,8 +16,19 @@ from django.views.generic import (
 from django.http import Http404, HttpResponseRedirect
 from django.urls import reverse_lazy
 
+from . import cache as profile_cache
+from . import graph, suggestions
 from .models import FriendShip
 from .forms import SignupForm
+from mysite.mixins import AsyncLoginRequiredMixin, ConditionalGetMixin
+from mysite.pagination import (
+    CursorPaginator,
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+)
+from tweets import timeline
+from tweets.fragments import tweet_row_cache
 from tweets.models import Like, Tweet
 
 User = get_user_model()
@@ -38,18 +53,27 @@ class HomeView(ListView):
     model = Tweet
     template_name = "home.html"
     context_object_name = "tweet_list"
-    queryset = (
-        Tweet.objects.select_related("user")
-        .prefetch_related("like_set")
-        .order_by("-created_at")
-    )
+
+    def get_queryset(self):
+        engine = timeline.get_timeline(self.request.user)
+        try:
+            self.page = engine.page(
+                self.request.user,
+                self.request.GET.get("cursor"),
+                settings.TIMELINE_PAGE_SIZE,
+            )
+        except InvalidCursor:
+            raise Http404
+        return self.page.object_list
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
-        context["like_list"] = Like.objects.filter(user=user).values_list(
-            "tweet", flat=True
+        context["next_cursor"] = self.page.next_cursor
+        context["tweet_rows"] = tweet_row_cache.render(self.page.object_list)
+        context["like_list"] = Like.objects.liked_tweet_ids(
+            self.request.user, self.page.object_list
         )
+        context["suggestions"] = suggestions.get_suggestions(self.request.user)
         return context
 
 
@@ -61,6 +85,18 @@ class LogoutView(LogoutView):
     template_name = "registration/login.html"
 
 
+def follow_user(follower, following):
+    with transaction.atomic():
+        FriendShip.objects.get_or_create(follower=follower, following=following)
+        timeline.on_follow(follower, following)
+
+
+def unfollow_user(follower, following):
+    with transaction.atomic():
+        FriendShip.objects.filter(following=following, follower=follower).delete()
+        timeline.on_unfollow(follower, following)
+
+
 class FollowView(LoginRequiredMixin, TemplateView):
     model = FriendShip
 
@@ -73,10 +109,28 @@ class FollowView(LoginRequiredMixin, TemplateView):
             raise Http404
         if follower == following:
             messages.error(request, "You can't follow yourself.")
-        elif FriendShip.objects.filter(follower=follower, following=following).exists():
+        elif graph.is_following(follower.pk, following.pk):
+            messages.error(request, "You have already followed.")
+        else:
+            follow_user(follower, following)
+            messages.success(request, "You've just followed.")
+        return HttpResponseRedirect(reverse_lazy("accounts:home"))
+
+
+class AsyncFollowView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
+        follower = self.request.user
+        try:
+            following = await User.objects.aget(username=self.kwargs["username"])
+        except User.DoesNotExist:
+            messages.error(request, "This user does not exist.")
+            raise Http404
+        if follower == following:
+            messages.error(request, "You can't follow yourself.")
+        elif await sync_to_async(graph.is_following)(follower.pk, following.pk):
             messages.error(request, "You have already followed.")
         else:
-            FriendShip.objects.get_or_create(follower=follower, following=following)
+            await sync_to_async(follow_user)(follower, following)
             messages.success(request, "You've just followed.")
         return HttpResponseRedirect(reverse_lazy("accounts:home"))
 
@@ -93,55 +147,192 @@ class UnFollowView(LoginRequiredMixin, TemplateView):
             raise Http404
         if follower == following:
             messages.error(request, "This is your account.")
-        elif FriendShip.objects.filter(follower=follower, following=following).exists():
-            FriendShip.objects.filter(following=following, follower=follower).delete()
+        elif graph.is_following(follower.pk, following.pk):
+            unfollow_user(follower, following)
             messages.success(request, "You've just unfollowed.")
         else:
             messages.error(request, "You haven't follow the user.")
         return HttpResponseRedirect(reverse_lazy("accounts:home"))
 
 
-class FollowingListView(LoginRequiredMixin, TemplateView):
-    model = User
-    template_name = "accounts/following_list.html"
+class AsyncUnFollowView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
+        follower = self.request.user
+        try:
+            following = await User.objects.aget(username=self.kwargs["username"])
+        except User.DoesNotExist:
+            messages.error(request, "This user does not exist.")
+            raise Http404
+        if follower == following:
+            messages.error(request, "This is your account.")
+        elif await sync_to_async(graph.is_following)(follower.pk, following.pk):
+            await sync_to_async(unfollow_user)(follower, following)
+            messages.success(request, "You've just unfollowed.")
+        else:
+            messages.error(request, "You haven't follow the user.")
+        return HttpResponseRedirect(reverse_lazy("accounts:home"))
+
+
+class FriendShipListView(LoginRequiredMixin, TemplateView):
+    # user_field が対象ユーザーの FriendShip を、相手 (other_field) の pk 順に keyset で返す
+    # (user_field, other_field) の索引だけで絞り込みと並び替えができる
+    user_field = None
+    other_field = None
+    context_list_name = None
 
     def get_context_data(self, *args, **kwargs):
-        username = self.kwargs["username"]
-        user = get_object_or_404(User, username=username)
+        user_pk = (
+            User.objects.filter(username=self.kwargs["username"])
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if user_pk is None:
+            raise Http404
+        cursor = self.request.GET.get("cursor")
+        try:
+            if settings.SOCIAL_GRAPH_ENABLED:
+                rows, next_cursor = self.get_graph_page(user_pk, cursor)
+            else:
+                rows, next_cursor = self.get_page(user_pk, cursor)
+        except InvalidCursor:
+            raise Http404
         context = super().get_context_data(*args, **kwargs)
-        context["following_list"] = FriendShip.objects.select_related(
-            "following"
-        ).filter(follower=user)
+        context[self.context_list_name] = rows
+        context["next_cursor"] = next_cursor
 
         return context
 
+    def get_page(self, user_pk, cursor):
+        other_pk = f"{self.other_field}_id"
+        other_username = f"{self.other_field}__username"
+        viewer = self.request.user
+        # 閲覧者との関係も同じクエリで求める (どちらも FriendShip の索引だけで判定できる)
+        rows = (
+            FriendShip.objects.filter(**{self.user_field: user_pk})
+            .annotate(
+                you_follow=Exists(
+                    FriendShip.objects.filter(
+                        follower=viewer, following=OuterRef(other_pk)
+                    )
+                ),
+                follows_you=Exists(
+                    FriendShip.objects.filter(
+                        follower=OuterRef(other_pk), following=viewer
+                    )
+                ),
+            )
+            .values(other_pk, other_username, "you_follow", "follows_you")
+        )
+        paginator = CursorPaginator(rows, (other_pk,), settings.FRIENDSHIP_PAGE_SIZE)
+        page = paginator.page(cursor)
+        rows = [
+            {
+                "pk": row[other_pk],
+                "username": row[other_username],
+                "you_follow": row["you_follow"],
+                "follows_you": row["follows_you"],
+            }
+            for row in page
+        ]
+        return rows, page.next_cursor
 
-class FollowerListView(LoginRequiredMixin, TemplateView):
-    model = User
-    template_name = "accounts/follower_list.html"
-
-    def get_context_data(self, *args, **kwargs):
-        username = self.kwargs["username"]
-        user = get_object_or_404(User, username=username)
-        context = super().get_context_data(*args, **kwargs)
-        context["follower_list"] = FriendShip.objects.select_related("follower").filter(
-            following=user
+    def get_graph_page(self, user_pk, cursor):
+        # ソート済みの id 配列を二分探索でたどる (カーソルの形式は get_page と同じ)
+        social_graph = graph.social_graph
+        after = None
+        if cursor:
+            values = decode_cursor(cursor)
+            if (
+                not isinstance(values, list)
+                or len(values) != 1
+                or type(values[0]) is not int
+            ):
+                raise InvalidCursor(cursor)
+            after = values[0]
+        if self.other_field == "following":
+            ids = social_graph.following(user_pk)
+        else:
+            ids = social_graph.followers(user_pk)
+        page_size = settings.FRIENDSHIP_PAGE_SIZE
+        page_ids = social_graph.page(ids, after, page_size + 1)
+        next_cursor = None
+        if len(page_ids) > page_size:
+            page_ids = page_ids[:page_size]
+            next_cursor = encode_cursor([page_ids[-1]])
+        usernames = dict(
+            User.objects.filter(pk__in=page_ids).values_list("pk", "username")
         )
+        viewer = self.request.user
+        viewer_following = social_graph.following(viewer.pk)
+        viewer_followers = social_graph.followers(viewer.pk)
+        rows = [
+            {
+                "pk": pk,
+                "username": usernames[pk],
+                "you_follow": graph.contains(viewer_following, pk),
+                "follows_you": graph.contains(viewer_followers, pk),
+            }
+            for pk in page_ids
+            if pk in usernames
+        ]
+        return rows, next_cursor
 
-        return context
+
+class FollowingListView(FriendShipListView):
+    template_name = "accounts/following_list.html"
+    user_field = "follower"
+    other_field = "following"
+    context_list_name = "following_list"
+
+
+class FollowerListView(FriendShipListView):
+    template_name = "accounts/follower_list.html"
+    user_field = "following"
+    other_field = "follower"
+    context_list_name = "follower_list"
 
 
-class ProfileView(LoginRequiredMixin, DetailView):
+class ProfileView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     model = User
     template_name = "accounts/profile.html"
     context_object_name = "profile_user"
 
+    def get_validators(self):
+        self.profile = profile_cache.get_profile(self.kwargs["pk"])
+        if self.profile is None:
+            raise Http404
+        # フォロー/フォロー解除 で両者の follow_updated_at が進む
+        key = tuple(
+            self.profile[field]
+            for field in (
+                "pk",
+                "username",
+                "follower_count",
+                "following_count",
+                "follow_updated_at",
+            )
+        )
+        return key + (self.request.user.pk,), self.profile["follow_updated_at"]
+
+    def get_object(self, queryset=None):
+        return User(
+            pk=self.profile["pk"],
+            username=self.profile["username"],
+            follower_count=self.profile["follower_count"],
+            following_count=self.profile["following_count"],
+        )
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = get_object_or_404(User, pk=self.kwargs["pk"])
-        context["follower_number"] = FriendShip.objects.filter(following=user).count()
-        context["following_number"] = FriendShip.objects.filter(follower=user).count()
-        context["be_friends"] = FriendShip.objects.filter(
-            follower=self.request.user, following=user
-        ).exists
+        user = self.object
+        context["follower_number"] = user.follower_count
+        context["following_number"] = user.following_count
+        if settings.SOCIAL_GRAPH_ENABLED:
+            context["be_friends"] = graph.is_following(
+                self.request.user.pk, self.profile["pk"]
+            )
+        else:
+            context["be_friends"] = profile_cache.be_friends(
+                self.request.user, self.profile
+            )
         return context
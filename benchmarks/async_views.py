@@ -0,0 +1,140 @@
+# いいね/フォローの同期ビュー(WSGI + スレッドプール)と非同期ビュー(ASGI)のスループット比較
+#
+#   python -m benchmarks.async_views --concurrency 50 --requests 2000
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.base import format_latency, test_database  # isort: skip
+from django.db import connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import AsyncClient, Client
+
+from accounts.models import CustomUser
+from tweets.models import Tweet
+
+
+def begin_immediate(self):
+    # 並行書き込みで読み取りロックから書き込みロックへの昇格が衝突しないように、
+    # トランザクション開始時に書き込みロックを取る(busy timeout で待たせる)
+    self.cursor().execute("BEGIN IMMEDIATE")
+
+
+DatabaseWrapper._start_transaction_under_autocommit = begin_immediate
+
+
+def build_fixtures(users):
+    authors = CustomUser.objects.bulk_create(
+        [
+            CustomUser(username=f"bench{i}", email=f"bench{i}@example.com")
+            for i in range(users)
+        ]
+    )
+    tweets = Tweet.objects.bulk_create(
+        [Tweet(user=author, content="benchmark") for author in authors]
+    )
+    return authors, tweets
+
+
+def operations(prefix, authors, tweets, requests):
+    # ユーザーごとに like → unlike / follow → unfollow を交互に繰り返す
+    for i in range(requests):
+        user = authors[i % len(authors)]
+        target = (i // len(authors) // 2 + 1 + i) % len(authors)
+        undo = (i // len(authors)) % 2
+        if i % 4 < 2:
+            action = "unlike" if undo else "like"
+            url = f"/{prefix}/{tweets[target].pk}/{action}/"
+        else:
+            action = "unfollow" if undo else "follow"
+            url = f"/{prefix}/{authors[target].username}/{action}/"
+        yield user, url
+
+
+def summarize(label, latencies, elapsed):
+    print(
+        f"{label:<22} {len(latencies) / elapsed:8.1f} req/s  "
+        f"{format_latency(latencies)}"
+    )
+
+
+def run_wsgi(authors, tweets, concurrency, requests):
+    clients = {}
+
+    def client_for(user):
+        if user.pk not in clients:
+            clients[user.pk] = Client()
+            clients[user.pk].force_login(user)
+        return clients[user.pk]
+
+    work = [
+        (client_for(user), url)
+        for user, url in operations("sync", authors, tweets, requests)
+    ]
+
+    def send(item):
+        client, url = item
+        start = time.perf_counter()
+        response = client.post(url)
+        assert response.status_code < 400, (url, response.status_code)
+        connections.close_all()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(send, work))
+    return latencies, time.perf_counter() - start
+
+
+def run_asgi(authors, tweets, concurrency, requests):
+    clients = {}
+    work = []
+    for user, url in operations("async", authors, tweets, requests):
+        if user.pk not in clients:
+            clients[user.pk] = AsyncClient()
+            clients[user.pk].force_login(user)
+        work.append((clients[user.pk], url))
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(client, url):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(url)
+                assert response.status_code < 400, (url, response.status_code)
+                return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(send(client, url) for client, url in work))
+        return latencies, time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+
+    with test_database():
+        authors, tweets = build_fixtures(args.users)
+        print(
+            f"{args.requests} requests, concurrency {args.concurrency}, "
+            f"{args.users} users"
+        )
+        summarize(
+            "WSGI (sync views)",
+            *run_wsgi(authors, tweets, args.concurrency, args.requests),
+        )
+        summarize(
+            "ASGI (async views)",
+            *run_asgi(authors, tweets, args.concurrency, args.requests),
+        )
+
+
+if __name__ == "__main__":
+    main()
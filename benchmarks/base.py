@@ -0,0 +1,48 @@
+import os
+import statistics
+import tempfile
+from contextlib import contextmanager
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+
+@contextmanager
+def test_database(**overrides):
+    # スレッド間で共有できるように、テスト DB はファイルに作る
+    directory = tempfile.mkdtemp()
+    database = settings.DATABASES["default"]
+    database["TEST"]["NAME"] = os.path.join(directory, "bench.sqlite3")
+    database["OPTIONS"]["timeout"] = 30
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with override_settings(
+            ROOT_URLCONF="benchmarks.urls", DEBUG=False, **overrides
+        ):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[max(int(len(values) * percent / 100) - 1, 0)]
+
+
+def format_latency(latencies):
+    return (
+        f"p50 {statistics.median(latencies) * 1000:7.2f} ms  "
+        f"p95 {percentile(latencies, 95) * 1000:7.2f} ms"
+    )
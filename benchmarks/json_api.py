@@ -0,0 +1,82 @@
+# HTML のビューと JSON API の応答時間・クエリ数・応答サイズの比較
+#
+#   python -m benchmarks.json_api --requests 300
+import argparse
+import time
+
+from benchmarks.base import format_latency, test_database  # isort: skip
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.models import CustomUser
+from tweets.models import Tweet
+
+
+def build_fixtures(users, tweets_per_user):
+    authors = CustomUser.objects.bulk_create(
+        [
+            CustomUser(username=f"bench{i}", email=f"bench{i}@example.com")
+            for i in range(users)
+        ]
+    )
+    Tweet.objects.bulk_create(
+        [
+            Tweet(user=author, content=f"benchmark tweet {i}", like_count=i % 7)
+            for author in authors
+            for i in range(tweets_per_user)
+        ]
+    )
+    return authors
+
+
+def measure(client, url, requests):
+    latencies = []
+    with CaptureQueriesContext(connection) as queries:
+        client.get(url)
+    query_count = len(queries)
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, (url, response.status_code)
+    return latencies, query_count, len(response.content)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tweets-per-user", type=int, default=40)
+    args = parser.parse_args()
+
+    with test_database():
+        authors = build_fixtures(args.users, args.tweets_per_user)
+        client = Client()
+        client.force_login(authors[0])
+        tweet = Tweet.objects.order_by("pk").first()
+        pairs = [
+            (
+                "timeline",
+                reverse("accounts:home"),
+                reverse("tweets:api_timeline"),
+            ),
+            (
+                "tweet",
+                reverse("tweets:detail", kwargs={"pk": tweet.pk}),
+                reverse("tweets:api_detail", kwargs={"pk": tweet.pk}),
+            ),
+        ]
+        print(f"{args.requests} requests per view")
+        for name, html_url, api_url in pairs:
+            for kind, url in [("html", html_url), ("json", api_url)]:
+                latencies, queries, size = measure(client, url, args.requests)
+                print(
+                    f"{name:<8} {kind:<4}  {format_latency(latencies)}  "
+                    f"{queries:3d} queries  {size:7d} bytes"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+from django.urls import include, path
+
+from accounts import views as accounts_views
+from tweets import views as tweets_views
+
+# 同じ URL 構成で同期ビューと非同期ビューを並べてマウントする
+urlpatterns = [
+    path("", include("mysite.urls")),
+    path("sync/<int:pk>/like/", tweets_views.LikeView.as_view()),
+    path("sync/<int:pk>/unlike/", tweets_views.UnlikeView.as_view()),
+    path("sync/<str:username>/follow/", accounts_views.FollowView.as_view()),
+    path("sync/<str:username>/unfollow/", accounts_views.UnFollowView.as_view()),
+    path("async/<int:pk>/like/", tweets_views.AsyncLikeView.as_view()),
+    path("async/<int:pk>/unlike/", tweets_views.AsyncUnlikeView.as_view()),
+    path("async/<str:username>/follow/", accounts_views.AsyncFollowView.as_view()),
+    path("async/<str:username>/unfollow/", accounts_views.AsyncUnFollowView.as_view()),
+]
@@ -0,0 +1,294 @@
+# accounts.urls / tweets.urls の全ビューを seed したデータで叩き、
+# クエリ数・応答時間・ピークメモリを記録して view_budgets.json の予算と比べる
+#
+#   python -m benchmarks.view_budgets --sizes small,medium --output results.json
+#   python -m benchmarks.view_budgets --update   # 予算を今の計測値で書き直す
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from http.cookies import SimpleCookie
+from io import StringIO
+from pathlib import Path
+
+from benchmarks.base import percentile, test_database  # isort: skip
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts import urls as accounts_urls
+from accounts.models import CustomUser, FriendShip
+from tweets import urls as tweets_urls
+from tweets.buffer import like_buffer
+from tweets.models import HashTag, Like, Mention, Tweet
+
+BUDGETS_PATH = Path(__file__).with_name("view_budgets.json")
+
+SIZES = {
+    "small": {"users": 100, "follows": 10, "tweets": 10, "likes": 3},
+    "medium": {"users": 1000, "follows": 20, "tweets": 10, "likes": 5},
+    "large": {"users": 10000, "follows": 30, "tweets": 10, "likes": 5},
+}
+
+# 予算と比べる項目 (計測値がこれを超えたら失敗)。queries はキャッシュが空のときの数
+METRICS = ["queries", "p95_ms", "peak_kib"]
+
+
+# SSE はテストクライアント (WSGI) では流せないので測らない (ASYNC_VIEWS のときだけある)
+SKIPPED = {"tweets:like_stream"}
+
+
+def url_names():
+    names = [
+        f"{module.app_name}:{pattern.name}"
+        for module in (accounts_urls, tweets_urls)
+        for pattern in module.urlpatterns
+    ]
+    return [name for name in names if name not in SKIPPED]
+
+
+def build_cases(viewer):
+    # url 名 -> (メソッド, reverse の kwargs, クエリ文字列 / POST の内容)
+    followed = FriendShip.objects.filter(follower=viewer).values("following")
+    follow_target = (
+        CustomUser.objects.exclude(pk=viewer.pk).exclude(pk__in=followed).first()
+    )
+    unfollow_target = CustomUser.objects.filter(pk__in=followed).first()
+    profile_user = CustomUser.objects.order_by("-follower_count", "pk").first()
+    own_tweet = Tweet.objects.filter(user=viewer).first() or Tweet.objects.create(
+        user=viewer, content="benchmark"
+    )
+    popular_tweet = Tweet.objects.order_by("-like_count", "pk").first()
+    liked = Like.objects.filter(user=viewer).values("tweet")
+    unliked_tweet = Tweet.objects.exclude(pk__in=liked).first()
+    liked_tweet = Tweet.objects.filter(pk__in=liked).first()
+    if liked_tweet is None:
+        liked_tweet = Tweet.objects.exclude(pk=unliked_tweet.pk).first()
+        Like.objects.like(viewer, liked_tweet)
+    tag = (
+        HashTag.objects.values("tag")
+        .annotate(count=Count("pk"))
+        .order_by("-count", "tag")
+        .first()["tag"]
+    )
+    mentioned = (
+        Mention.objects.values("user__username")
+        .annotate(count=Count("pk"))
+        .order_by("-count", "user__username")
+        .first()["user__username"]
+    )
+    recent = list(Tweet.objects.order_by("-pk").values_list("pk", flat=True)[:50])
+    ids = ",".join(map(str, recent))
+    operations = [
+        {"tweet_pk": pk, "action": "like" if i % 2 else "unlike"}
+        for i, pk in enumerate(recent[:20])
+    ]
+    return {
+        "accounts:signup": ("get", {}, None),
+        "accounts:home": ("get", {}, None),
+        "accounts:login": ("get", {}, None),
+        "accounts:logout": ("post", {}, None),
+        "accounts:profile": ("get", {"pk": profile_user.pk}, None),
+        "accounts:follow": ("post", {"username": follow_target.username}, None),
+        "accounts:unfollow": ("post", {"username": unfollow_target.username}, None),
+        "accounts:following_list": ("get", {"username": viewer.username}, None),
+        "accounts:follower_list": ("get", {"username": profile_user.username}, None),
+        "tweets:create": ("post", {}, {"content": "benchmark #django"}),
+        "tweets:search": ("get", {}, {"q": "django"}),
+        "tweets:hashtag": ("get", {"tag": tag}, None),
+        "tweets:mention": ("get", {"username": mentioned}, None),
+        "tweets:detail": ("get", {"pk": popular_tweet.pk}, None),
+        "tweets:delete": ("post", {"pk": own_tweet.pk}, None),
+        "tweets:like": ("post", {"pk": unliked_tweet.pk}, None),
+        "tweets:unlike": ("post", {"pk": liked_tweet.pk}, None),
+        "tweets:like_counts": ("get", {}, {"ids": ids}),
+        "tweets:like_batch": ("json", {}, {"operations": operations}),
+        "tweets:api_timeline": ("get", {}, None),
+        "tweets:api_detail": ("get", {"pk": popular_tweet.pk}, None),
+        "tweets:api_user_tweets": ("get", {"username": profile_user.username}, None),
+    }
+
+
+def send(client, method, url, data):
+    # 書き込みのあるビューは毎回ロールバックして同じ状態から測る
+    # (ログアウトでセッションの cookie が消えるので元に戻す)
+    cookies = SimpleCookie(client.cookies)
+    try:
+        if method == "get":
+            response = client.get(url, data)
+        else:
+            with transaction.atomic():
+                if method == "json":
+                    response = client.post(
+                        url, json.dumps(data), content_type="application/json"
+                    )
+                else:
+                    response = client.post(url, data or {})
+                transaction.set_rollback(True)
+        # ストリーミング応答は本文を読まずに閉じる
+        response.close()
+    finally:
+        client.cookies = cookies
+    assert response.status_code < 400, (url, response.status_code)
+    return response
+
+
+def reset_caches():
+    # 行・プロフィールのキャッシュやいいねのバッファが効いていると
+    # 1 行ごとのクエリ (N+1) がクエリ数に出ないので、空の状態でも数える
+    like_buffer.flush()
+    for cache in caches.all():
+        cache.clear()
+
+
+def count_queries(client, method, url, data):
+    with CaptureQueriesContext(connection) as queries:
+        send(client, method, url, data)
+    return len(queries)
+
+
+def run_case(client, name, case, requests):
+    method, kwargs, data = case
+    url = reverse(name, kwargs=kwargs)
+    reset_caches()
+    cold_queries = count_queries(client, method, url, data)
+    warm_queries = count_queries(client, method, url, data)
+
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        send(client, method, url, data)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        send(client, method, url, data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "queries": cold_queries,
+        "warm_queries": warm_queries,
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def run_size(size, requests, seed):
+    with test_database():
+        call_command("seed", seed=seed, stdout=StringIO(), **SIZES[size])
+        viewer = CustomUser.objects.order_by("-following_count", "pk").first()
+        cases = build_cases(viewer)
+        missing = [name for name in url_names() if name not in cases]
+        if missing:
+            raise SystemExit(f"No benchmark case for: {', '.join(missing)}")
+        client = Client()
+        client.force_login(viewer)
+        results = {}
+        for name in url_names():
+            results[name] = run_case(client, name, cases[name], requests)
+            print(
+                f"{size:<6} {name:<26} {results[name]['queries']:4d} queries "
+                f"({results[name]['warm_queries']:2d} cached)  "
+                f"p50 {results[name]['p50_ms']:8.2f} ms  "
+                f"p95 {results[name]['p95_ms']:8.2f} ms  "
+                f"{results[name]['peak_kib']:9.1f} KiB"
+            )
+        return results
+
+
+def check(results, budgets, metrics):
+    failures = []
+    for size, views in results.items():
+        for name, measured in views.items():
+            budget = budgets.get(size, {}).get(name)
+            if budget is None:
+                failures.append(f"{size} {name}: no budget recorded")
+                continue
+            for metric in metrics:
+                if metric in budget and measured[metric] > budget[metric]:
+                    failures.append(
+                        f"{size} {name}: {metric} {measured[metric]} "
+                        f"> budget {budget[metric]}"
+                    )
+    return failures
+
+
+def updated_budgets(results, budgets, headroom):
+    # クエリ数はそのまま、時間とメモリは揺れる分の余裕を持たせて記録する
+    for size, views in results.items():
+        budgets[size] = {
+            name: {
+                "queries": measured["queries"],
+                "p95_ms": round(measured["p95_ms"] * headroom, 1),
+                "peak_kib": round(measured["peak_kib"] * headroom, 1),
+            }
+            for name, measured in views.items()
+        }
+    return budgets
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="small,medium")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--budgets", default=str(BUDGETS_PATH))
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument("--headroom", type=float, default=2.0)
+    parser.add_argument(
+        "--metrics",
+        default=",".join(METRICS),
+        help="Metrics to check (e.g. only 'queries' on noisy machines).",
+    )
+    args = parser.parse_args()
+
+    sizes = args.sizes.split(",")
+    unknown = set(sizes) - SIZES.keys()
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(sorted(unknown))}")
+    results = {size: run_size(size, args.requests, args.seed) for size in sizes}
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "requests": args.requests,
+            "seed": args.seed,
+            "results": results,
+        }
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+    budgets_path = Path(args.budgets)
+    budgets = json.loads(budgets_path.read_text()) if budgets_path.exists() else {}
+    if args.update:
+        budgets = updated_budgets(results, budgets, args.headroom)
+        budgets_path.write_text(json.dumps(budgets, indent=2, sort_keys=True) + "\n")
+        print(f"Updated {budgets_path}")
+        return
+    failures = check(results, budgets, args.metrics.split(","))
+    for failure in failures:
+        print(f"OVER BUDGET  {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import hashlib
+
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+
+def conditional_json_response(request, data):
+    # 本文のハッシュを ETag にし、If-None-Match が一致すれば 304 を返す
+    response = JsonResponse(data, json_dumps_params={"separators": (",", ":")})
+    etag = quote_etag(hashlib.md5(response.content).hexdigest())
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=etag, response=response)
@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+# ログに残す SQL の最大長 (パラメータは含めない)
+SQL_LOG_LENGTH = 500
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_SALT = "mysite.middleware.profile"
+TEMPLATE_RENDER_CODE = Template._render.__code__
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_duration = 0.0
+        self.slowest_sql = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if duration >= self.slowest_duration:
+                self.slowest_duration = duration
+                self.slowest_sql = sql
+
+    def install(self):
+        # 接続はスレッドごとなので、クエリを実行するスレッドで呼ぶ
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+def sampled(rate):
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+class AsyncCapableMiddleware:
+    # ASGI でも同期/非同期の変換を挟まないように、get_response に合わせて動く
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process(request)
+
+
+class QueryTimingMiddleware(AsyncCapableMiddleware):
+    # SQL_TIMING_SAMPLE_RATE の割合のリクエストだけ、クエリ数・DB 時間・一番遅い SQL を
+    # Server-Timing ヘッダーとログ (JSON 1 行) に出す。サンプルしないリクエストは素通り
+
+    def process(self, request):
+        if not sampled(settings.SQL_TIMING_SAMPLE_RATE):
+            return self.get_response(request)
+        stats = QueryStats()
+        start = time.perf_counter()
+        with stats.install():
+            response = self.get_response(request)
+        return self.report(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not sampled(settings.SQL_TIMING_SAMPLE_RATE):
+            return await self.get_response(request)
+        stats = QueryStats()
+        start = time.perf_counter()
+        # ORM は sync_to_async のスレッドで動くので、そのスレッドの接続に差し込む
+        stack = await sync_to_async(stats.install)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.report(request, response, stats, time.perf_counter() - start)
+
+    def report(self, request, response, stats, duration):
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries"',
+                f"db-slowest;dur={stats.slowest_duration * 1000:.2f}",
+                f"total;dur={duration * 1000:.2f}",
+            ]
+        )
+        match = request.resolver_match
+        logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "view": match.view_name if match else None,
+                    "status": response.status_code,
+                    "queries": stats.count,
+                    "db_ms": round(stats.duration * 1000, 2),
+                    "slowest_ms": round(stats.slowest_duration * 1000, 2),
+                    "slowest_sql": (stats.slowest_sql or "")[:SQL_LOG_LENGTH],
+                    "total_ms": round(duration * 1000, 2),
+                },
+                separators=(",", ":"),
+            )
+        )
+        return response
+
+
+def profile_token():
+    # X-Profile ヘッダーに付ける値。SECRET_KEY で署名し、PROFILER_TOKEN_MAX_AGE 秒まで有効
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign("profile")
+
+
+def valid_profile_token(token):
+    try:
+        signing.TimestampSigner(salt=PROFILE_SALT).unsign(
+            token, max_age=settings.PROFILER_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def frame_label(frame):
+    code = frame.f_code
+    if code is TEMPLATE_RENDER_CODE:
+        # テンプレートごとに分けて見えるようにする
+        name = getattr(frame.f_locals.get("self"), "name", None)
+        label = f"template:{name}"
+    else:
+        label = f"{frame.f_globals.get('__name__', '?')}:{code.co_name}"
+    return label.replace(";", "_").replace(" ", "_")
+
+
+class StackSampler(threading.Thread):
+    # 対象スレッドのスタックを interval 秒ごとに取り、
+    # flamegraph の collapsed 形式 ("root;...;leaf" -> 回数) で数える
+
+    def __init__(self, thread_ids, interval):
+        super().__init__(daemon=True)
+        self.thread_ids = set(thread_ids)
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                if labels:
+                    self.stacks[";".join(reversed(labels))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+class ProfileStore:
+    # url 名ごとにプロセス内で集計し、<PROFILER_DIR>/<url 名>.<pid>.folded に書き出す
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = defaultdict(Counter)
+
+    def add(self, view_name, stacks):
+        if not stacks:
+            return
+        with self._lock:
+            profile = self._profiles[view_name]
+            profile.update(stacks)
+            lines = [f"{stack} {count}\n" for stack, count in sorted(profile.items())]
+        directory = Path(settings.PROFILER_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{view_name.replace(':', '-')}.{os.getpid()}.folded"
+        temp_path = path.with_name(f".{path.name}.{threading.get_ident()}")
+        temp_path.write_text("".join(lines))
+        os.replace(temp_path, path)
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+profile_store = ProfileStore()
+
+
+class ProfilerMiddleware(AsyncCapableMiddleware):
+    # PROFILER_SAMPLE_RATE の割合のリクエストか、署名付きの X-Profile ヘッダーが
+    # 付いたリクエストだけ、別スレッドでスタックをサンプリングする
+
+    def process(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        sampler = StackSampler([threading.get_ident()], settings.PROFILER_INTERVAL)
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = sampler.stop()
+        self.save(request, stacks)
+        return response
+
+    async def __acall__(self, request):
+        if not self.should_profile(request):
+            return await self.get_response(request)
+        # event loop のスレッドと、sync_to_async で同期処理が動くスレッドの両方を取る
+        # (event loop 側には同時に処理中の他のリクエストも写り込む)
+        thread_ids = [threading.get_ident(), await sync_to_async(threading.get_ident)()]
+        sampler = StackSampler(thread_ids, settings.PROFILER_INTERVAL)
+        sampler.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stacks = await sync_to_async(sampler.stop, thread_sensitive=False)()
+        await sync_to_async(self.save, thread_sensitive=False)(request, stacks)
+        return response
+
+    def save(self, request, stacks):
+        match = request.resolver_match
+        profile_store.add(match.view_name if match else "unresolved", stacks)
+
+    def should_profile(self, request):
+        token = request.headers.get(PROFILE_HEADER)
+        if token is not None and valid_profile_token(token):
+            return True
+        return sampled(settings.PROFILER_SAMPLE_RATE)
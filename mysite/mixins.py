@@ -0,0 +1,38 @@
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views import View
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    # request.user は遅延評価でセッションとユーザーを読むので、先にスレッドで解決しておく
+
+    async def dispatch(self, request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return self.handle_no_permission()
+        return await View.dispatch(self, request, *args, **kwargs)
+
+
+class ConditionalGetMixin:
+    # get_validators() は ETag の元になる値と最終更新日時を安く求める
+    # 一致すればオブジェクトの取得やテンプレートの描画をせずに 304 を返す
+
+    def get_validators(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        key, last_modified = self.get_validators()
+        etag = quote_etag(hashlib.md5(repr(key).encode()).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        response["ETag"] = etag
+        if timestamp is not None:
+            response["Last-Modified"] = http_date(timestamp)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,100 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(data):
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise InvalidCursor(cursor)
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class CursorPaginator:
+    # ordering のカラムをキーにした keyset ページネーション(OFFSET を使わない)
+
+    def __init__(self, queryset, ordering, page_size):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.page_size = page_size
+        self.fields = [
+            (name.lstrip("-"), name.startswith("-")) for name in self.ordering
+        ]
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode(cursor)))
+        rows = list(queryset[: self.page_size + 1])
+        next_cursor = None
+        if len(rows) > self.page_size:
+            rows = rows[: self.page_size]
+            next_cursor = self.encode(rows[-1])
+        return CursorPage(rows, next_cursor)
+
+    def encode(self, row):
+        values = []
+        for name, _ in self.fields:
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            if hasattr(value, "isoformat"):
+                value = value.isoformat()
+            values.append(value)
+        return encode_cursor(values)
+
+    def decode(self, cursor):
+        values = decode_cursor(cursor)
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise InvalidCursor(cursor)
+        opts = self.queryset.model._meta
+        try:
+            return [
+                opts.get_field(name).to_python(value)
+                for (name, _), value in zip(self.fields, values)
+            ]
+        except (FieldDoesNotExist, ValidationError):
+            raise InvalidCursor(cursor)
+
+    def _after(self, values):
+        # (a, b) < (x, y) を (a < x) OR (a = x AND b < y) に展開する
+        # 先頭に a <= x を付けて、インデックスを範囲検索できるようにする
+        condition = Q()
+        for i, (name, descending) in enumerate(self.fields):
+            lookup = "lt" if descending else "gt"
+            step = Q(**{f"{name}__{lookup}": values[i]})
+            for (prev_name, _), prev_value in zip(self.fields[:i], values[:i]):
+                step &= Q(**{prev_name: prev_value})
+            condition |= step
+        if len(self.fields) > 1:
+            name, descending = self.fields[0]
+            lookup = "lte" if descending else "gte"
+            condition = Q(**{f"{name}__{lookup}": values[0]}) & condition
+        return condition
@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "mysite.middleware.QueryTimingMiddleware",
+    "mysite.middleware.ProfilerMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -145,3 +147,72 @@ AUTH_USER_MODEL = "accounts.CustomUser"
 LOGIN_URL = "accounts:login"
 LOGIN_REDIRECT_URL = "accounts:home"
 LOGOUT_REDIRECT_URL = "accounts:login"
+
+TIMELINE_PAGE_SIZE = 20
+
+# "global": 全ユーザーのツイート / "fanout": フォロー中のユーザーのツイート(書き込み時に展開)
+# "merge": フォロー中のユーザーのツイート(読み込み時にマージ)
+# fanout 以外では TimelineEntry に書き込まないので、fanout に切り替えるときは rebuild_timelines を実行する
+HOME_TIMELINE_ENGINE = "global"
+TIMELINE_BACKFILL_SIZE = 200
+TIMELINE_FANOUT_BATCH_SIZE = 1000
+# merge で 1 クエリにまとめるユーザー数 (SQLite の複合 SELECT は既定で 500 まで)
+TIMELINE_MERGE_BATCH_SIZE = 200
+
+# いいねの書き込みをプロセス内でまとめる (件数または秒数でフラッシュ、0 で定期フラッシュなし)
+LIKE_BUFFER_ENABLED = False
+LIKE_BUFFER_MAX_SIZE = 500
+LIKE_BUFFER_FLUSH_INTERVAL = 1.0
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+TWEET_ROW_CACHE_TIMEOUT = 60 * 60
+PROFILE_CACHE_TIMEOUT = 60 * 10
+
+# ASGI で動かすときは いいね/フォロー を非同期ビューで処理する
+ASYNC_VIEWS = False
+
+# いいね数の SSE 配信: 更新をまとめて送る間隔と、無通信時の keepalive 間隔 (秒)
+LIVE_LIKES_TICK = 0.5
+LIVE_LIKES_KEEPALIVE = 15
+
+FRIENDSHIP_PAGE_SIZE = 50
+
+# ホームに表示するおすすめユーザーの数
+SUGGESTION_COUNT = 5
+
+# フォロー関係をプロセス内にソート済み配列で持つ (プロセスごとのキャッシュなので既定は無効)
+SOCIAL_GRAPH_ENABLED = False
+SOCIAL_GRAPH_MAX_BYTES = 32 * 1024 * 1024
+
+# SQL の計測を行うリクエストの割合 (0 で無効、1 で全リクエスト)
+SQL_TIMING_SAMPLE_RATE = 0.0
+
+# スタックをサンプリングするリクエストの割合 (0 でも署名付き X-Profile ヘッダーがあれば取る)
+# 結果は PROFILER_DIR に url 名ごとの collapsed 形式で書き出し、profile_report で集計する
+PROFILER_SAMPLE_RATE = 0.0
+PROFILER_INTERVAL = 0.005
+PROFILER_DIR = BASE_DIR / "profiles"
+PROFILER_TOKEN_MAX_AGE = 60 * 60
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "mysite.middleware": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
+# 2 文字以下の語だけの検索 (LIKE) で対象にする新しいツイートの件数
+SEARCH_SHORT_TERM_WINDOW = 100000
@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404, HttpResponseBadRequest
+from django.views import View
+
+from mysite.http import conditional_json_response
+from mysite.pagination import CursorPaginator, InvalidCursor
+
+from . import timeline
+from .models import Tweet
+from .views import pending_like_count
+
+User = get_user_model()
+
+# モデルを作らずに values() の dict からそのまま JSON を組み立てる
+TWEET_FIELDS = (
+    "id",
+    "content",
+    "created_at",
+    "like_count",
+    "user_id",
+    "user__username",
+)
+
+
+def serialize_tweet(row):
+    return {
+        "id": row["id"],
+        "content": row["content"],
+        "created_at": row["created_at"].isoformat(),
+        "like_count": pending_like_count(row["id"], row["like_count"]),
+        "user": {"id": row["user_id"], "username": row["user__username"]},
+    }
+
+
+def page_response(request, page):
+    context = {
+        "tweets": [serialize_tweet(row) for row in page],
+        "next_cursor": page.next_cursor,
+    }
+    return conditional_json_response(request, context)
+
+
+class TimelineAPIView(View):
+    def get(self, request, *args, **kwargs):
+        engine = timeline.get_timeline(request.user)
+        try:
+            page = engine.page(
+                request.user,
+                request.GET.get("cursor"),
+                settings.TIMELINE_PAGE_SIZE,
+                fields=TWEET_FIELDS,
+            )
+        except InvalidCursor:
+            return HttpResponseBadRequest()
+        return page_response(request, page)
+
+
+class TweetAPIView(LoginRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        row = Tweet.objects.filter(pk=kwargs["pk"]).values(*TWEET_FIELDS).first()
+        if row is None:
+            raise Http404
+        return conditional_json_response(request, {"tweet": serialize_tweet(row)})
+
+
+class UserTweetsAPIView(LoginRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        user_pk = (
+            User.objects.filter(username=kwargs["username"])
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if user_pk is None:
+            raise Http404
+        paginator = CursorPaginator(
+            Tweet.objects.filter(user_id=user_pk).values(*TWEET_FIELDS),
+            ("-created_at", "-id"),
+            settings.TIMELINE_PAGE_SIZE,
+        )
+        try:
+            page = paginator.page(request.GET.get("cursor"))
+        except InvalidCursor:
+            return HttpResponseBadRequest()
+        return page_response(request, page)
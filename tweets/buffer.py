@@ -0,0 +1,123 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Like
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    # プロセス内で いいね/いいね解除 をためておき、一定間隔または件数でまとめて書き込む
+    # 同じ (user, tweet) への操作は後のものが優先され、書き込みは差分だけになる
+    # _intents: (user, tweet) -> (最初の操作の時点で いいね 済みか, 最後の操作)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._intents = {}
+        self._deltas = defaultdict(int)
+        self._timer = None
+
+    def __len__(self):
+        return len(self._intents)
+
+    def add(self, user_id, tweet_id, liked):
+        self.add_many(user_id, {tweet_id: liked})
+
+    def add_many(self, user_id, intents):
+        # intents: tweet_id -> liked。最初の操作では実際に いいね 済みかを確かめ、
+        # 状態が変わるときだけ件数を増減させる
+        checked = {}
+        while True:
+            with self._lock:
+                unknown = [
+                    tweet_id
+                    for tweet_id in intents
+                    if (user_id, tweet_id) not in self._intents
+                    and tweet_id not in checked
+                ]
+                if not unknown:
+                    for tweet_id, liked in intents.items():
+                        self._record(user_id, tweet_id, liked, checked.get(tweet_id))
+                    size = len(self._intents)
+                    break
+            liked_ids = set(
+                Like.objects.filter(user_id=user_id, tweet_id__in=unknown).values_list(
+                    "tweet_id", flat=True
+                )
+            )
+            checked.update({tweet_id: tweet_id in liked_ids for tweet_id in unknown})
+        with self._lock:
+            interval = settings.LIKE_BUFFER_FLUSH_INTERVAL
+            if self._timer is None and interval:
+                self._timer = threading.Timer(interval, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if size >= settings.LIKE_BUFFER_MAX_SIZE:
+            self.flush()
+
+    def _record(self, user_id, tweet_id, liked, original):
+        key = (user_id, tweet_id)
+        original, current = self._intents.get(key, (original, None))
+        self._deltas[tweet_id] -= self._contribution(original, current)
+        self._deltas[tweet_id] += self._contribution(original, liked)
+        self._intents[key] = (original, liked)
+
+    def pending_delta(self, tweet_id):
+        with self._lock:
+            return self._deltas.get(tweet_id, 0)
+
+    def pending_likes(self, user_id, tweet_ids):
+        # まだ書き込んでいない最後の操作 (tweet_id -> liked)
+        with self._lock:
+            return {
+                tweet_id: self._intents[(user_id, tweet_id)][1]
+                for tweet_id in tweet_ids
+                if (user_id, tweet_id) in self._intents
+            }
+
+    def flush(self):
+        with self._lock:
+            intents, self._intents = self._intents, {}
+            self._deltas = defaultdict(int)
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not intents:
+            return
+        likes = {key for key, (_, liked) in intents.items() if liked}
+        unlikes = {key for key, (_, liked) in intents.items() if not liked}
+        try:
+            Like.objects.apply(likes, unlikes)
+        except Exception:
+            self._restore(intents)
+            raise
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to flush the like buffer.")
+        finally:
+            connections.close_all()
+
+    def _restore(self, intents):
+        with self._lock:
+            for key, (original, liked) in intents.items():
+                if key not in self._intents:
+                    self._intents[key] = (original, liked)
+                    self._deltas[key[1]] += self._contribution(original, liked)
+
+    @staticmethod
+    def _contribution(original, current):
+        if current is None or current == original:
+            return 0
+        return 1 if current else -1
+
+
+like_buffer = LikeBuffer()
+atexit.register(like_buffer.flush)
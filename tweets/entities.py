@@ -0,0 +1,61 @@
+import re
+
+from django.contrib.auth import get_user_model
+
+from .models import HashTag, Mention
+
+User = get_user_model()
+
+HASHTAG_RE = re.compile(r"(?<![\w#])#(\w+)")
+MENTION_RE = re.compile(r"(?<![\w@])@([\w.+-]+)")
+TAG_MAX_LENGTH = HashTag._meta.get_field("tag").max_length
+
+
+def parse_hashtags(content):
+    # 大文字小文字を区別せずにまとめる
+    return {
+        tag.casefold()
+        for tag in HASHTAG_RE.findall(content)
+        if len(tag) <= TAG_MAX_LENGTH
+    }
+
+
+def parse_mentions(content):
+    # 文末の "." はユーザー名に含めない
+    return {username.rstrip(".") for username in MENTION_RE.findall(content)} - {""}
+
+
+def build_entities(tweets):
+    # tweets: (id, content, created_at) の並び。HashTag / Mention のインスタンスを返す
+    hashtags = []
+    mentioned = []
+    for tweet_id, content, created_at in tweets:
+        hashtags += [
+            HashTag(tag=tag, tweet_id=tweet_id, created_at=created_at)
+            for tag in parse_hashtags(content)
+        ]
+        mentioned += [
+            (username, tweet_id, created_at) for username in parse_mentions(content)
+        ]
+    user_ids = dict(
+        User.objects.filter(
+            username__in={username for username, _, _ in mentioned}
+        ).values_list("username", "pk")
+    )
+    mentions = [
+        Mention(user_id=user_ids[username], tweet_id=tweet_id, created_at=created_at)
+        for username, tweet_id, created_at in mentioned
+        if username in user_ids
+    ]
+    return hashtags, mentions
+
+
+def save_entities(tweets):
+    hashtags, mentions = build_entities(tweets)
+    HashTag.objects.bulk_create(hashtags, ignore_conflicts=True)
+    Mention.objects.bulk_create(mentions, ignore_conflicts=True)
+    return hashtags, mentions
+
+
+def index_tweet(tweet):
+    return save_entities([(tweet.pk, tweet.content, tweet.created_at)])
@@ -0,0 +1,62 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+
+class TweetRow:
+    def __init__(self, tweet, head, tail):
+        self.tweet = tweet
+        self.head = head
+        self.tail = tail
+
+
+class TweetRowCache:
+    # ツイート1行分の HTML をユーザー間で使い回す (いいねボタンは閲覧者ごとに別で描画する)
+    # キーに like_count と投稿者の username を含めるので、いいね/解除 や
+    # ユーザー名の変更で自動的に新しいバージョンになる
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, tweet):
+        return (
+            f"tweet-row:{tweet.pk}:{tweet.created_at.timestamp()}:{tweet.like_count}"
+            f":{tweet.user.username}"
+        )
+
+    def render(self, tweets):
+        keys = {tweet.pk: self.key(tweet) for tweet in tweets}
+        cached = cache.get_many(keys.values())
+        rendered = {}
+        rows = []
+        for tweet in tweets:
+            key = keys[tweet.pk]
+            fragment = cached.get(key)
+            if fragment is None:
+                fragment = (
+                    render_to_string("tweets/tweet_row.html", {"tweet": tweet}),
+                    render_to_string("tweets/like_count.html", {"tweet": tweet}),
+                )
+                rendered[key] = fragment
+            rows.append(TweetRow(tweet, mark_safe(fragment[0]), mark_safe(fragment[1])))
+        if rendered:
+            cache.set_many(rendered, settings.TWEET_ROW_CACHE_TIMEOUT)
+        with self._lock:
+            self.hits += len(tweets) - len(rendered)
+            self.misses += len(rendered)
+        return rows
+
+    def invalidate(self, tweet):
+        cache.delete(self.key(tweet))
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+tweet_row_cache = TweetRowCache()
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+
+class Subscription:
+    def __init__(self, tweet_ids):
+        self.tweet_ids = frozenset(tweet_ids)
+        self._updates = {}
+        self._event = asyncio.Event()
+
+    def push(self, tweet_id, delta, like_count):
+        # 読み出しが追いつかない間の更新もツイートごとに 1 件にまとめる
+        previous = self._updates.get(tweet_id)
+        if previous:
+            delta += previous["delta"]
+        self._updates[tweet_id] = {
+            "tweet_pk": tweet_id,
+            "delta": delta,
+            "like_count": like_count,
+        }
+        self._event.set()
+
+    async def next(self, timeout=None):
+        if not self._event.is_set():
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._event.clear()
+        updates, self._updates = self._updates, {}
+        return sorted(updates.values(), key=lambda update: update["tweet_pk"])
+
+
+class LikeCountBroker:
+    # プロセス内の pub/sub。publish はどのスレッドからでも呼べて、
+    # 購読者へは tick ごとにツイート単位でまとめた増減を event loop 上で配る
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._subscribers = defaultdict(set)
+        self._ticker = None
+
+    def publish(self, tweet_id, delta, like_count):
+        if not delta:
+            return
+        with self._lock:
+            if tweet_id not in self._subscribers:
+                return
+            previous = self._pending.get(tweet_id)
+            if previous:
+                delta += previous[0]
+            self._pending[tweet_id] = (delta, like_count)
+
+    def subscribe(self, tweet_ids):
+        subscription = Subscription(tweet_ids)
+        with self._lock:
+            for tweet_id in subscription.tweet_ids:
+                self._subscribers[tweet_id].add(subscription)
+        loop = asyncio.get_running_loop()
+        if (
+            self._ticker is None
+            or self._ticker.done()
+            or self._ticker.get_loop() is not loop
+        ):
+            self._ticker = loop.create_task(self._tick())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for tweet_id in subscription.tweet_ids:
+                subscribers = self._subscribers.get(tweet_id)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[tweet_id]
+                    self._pending.pop(tweet_id, None)
+
+    def dispatch(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            targets = [
+                (tweet_id, update, list(self._subscribers.get(tweet_id, ())))
+                for tweet_id, update in pending.items()
+            ]
+        for tweet_id, (delta, like_count), subscribers in targets:
+            for subscription in subscribers:
+                subscription.push(tweet_id, delta, like_count)
+
+    async def _tick(self):
+        while self._subscribers:
+            await asyncio.sleep(settings.LIVE_LIKES_TICK)
+            self.dispatch()
+        if self._ticker is asyncio.current_task():
+            self._ticker = None
+
+
+like_count_broker = LikeCountBroker()
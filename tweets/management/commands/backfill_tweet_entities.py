@@ -0,0 +1,36 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweets.entities import save_entities
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "Index hashtags and mentions of existing tweets in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        rows = (
+            Tweet.objects.order_by("pk")
+            .values_list("pk", "content", "created_at")
+            .iterator(chunk_size=chunk_size)
+        )
+        tweets = hashtags = mentions = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            with transaction.atomic():
+                created_hashtags, created_mentions = save_entities(chunk)
+            tweets += len(chunk)
+            hashtags += len(created_hashtags)
+            mentions += len(created_mentions)
+        self.stdout.write(
+            f"Indexed {hashtags} hashtags and {mentions} mentions "
+            f"from {tweets} tweets."
+        )
@@ -0,0 +1,76 @@
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def read_folded(path):
+    stacks = Counter()
+    for line in path.read_text().splitlines():
+        stack, _, count = line.rpartition(" ")
+        if stack and count.isdigit():
+            stacks[stack] += int(count)
+    return stacks
+
+
+class Command(BaseCommand):
+    help = "Merge sampled stack profiles and rank the hottest functions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=None, help="Defaults to PROFILER_DIR.")
+        parser.add_argument(
+            "--view", action="append", help="Only include these url names."
+        )
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument(
+            "--output", help="Write the merged stacks in collapsed (folded) format."
+        )
+
+    def handle(self, *args, **options):
+        directory = Path(options["dir"] or settings.PROFILER_DIR)
+        views = {view.replace(":", "-") for view in options["view"] or ()}
+        # ファイル名は <url 名>.<pid>.folded
+        paths = [
+            path
+            for path in sorted(directory.glob("*.folded"))
+            if not views or path.name.rsplit(".", 2)[0] in views
+        ]
+        if not paths:
+            raise CommandError(f"No profiles found in {directory}.")
+
+        stacks = Counter()
+        for path in paths:
+            stacks.update(read_folded(path))
+        if options["output"]:
+            Path(options["output"]).write_text(
+                "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+            )
+
+        # self: スタックの先頭 (実行中の関数)、total: スタックのどこかに現れる (再帰は 1 回)
+        own = Counter()
+        total = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        samples = sum(stacks.values())
+        self.stdout.write(f"{samples} samples from {len(paths)} files")
+        self.stdout.write(
+            f"{'self':>8} {'self%':>6} {'total':>8} {'total%':>6}  function"
+        )
+        for frame, count in own.most_common(options["limit"]):
+            self.stdout.write(
+                f"{count:8d} {count / samples:6.1%} {total[frame]:8d} "
+                f"{total[frame] / samples:6.1%}  {frame}"
+            )
+        self.stdout.write("")
+        self.stdout.write("Templates by total samples")
+        templates = [
+            (frame, count)
+            for frame, count in total.most_common()
+            if frame.startswith("template:")
+        ]
+        for frame, count in templates[: options["limit"]]:
+            self.stdout.write(f"{count:8d} {count / samples:6.1%}  {frame}")
@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweets import timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the materialized home timelines used by the fanout engine "
+        "from FriendShip and Tweet in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_pk = 0
+        users = 0
+        while True:
+            user_pks = list(
+                User.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not user_pks:
+                break
+            with transaction.atomic():
+                timeline.rebuild(user_pks)
+            users += len(user_pks)
+            last_pk = user_pks[-1]
+        self.stdout.write(f"Rebuilt home timelines of {users} users.")
@@ -0,0 +1,123 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from tweets.models import Tweet
+from tweets.search import FTS_TABLE
+
+TWEET_TABLE = Tweet._meta.db_table
+SHADOW_TABLE = f"{FTS_TABLE}_rebuild"
+# 影のテーブルに何番の id まで入れたか (トリガーから参照するので普通のテーブルにする)
+STATE_TABLE = f"{FTS_TABLE}_rebuild_state"
+
+# {table} に書き込むトリガー。名前と索引は 0008_tweet_search のものと同じ形
+TRIGGER_SQL = [
+    """
+    CREATE TRIGGER {table}_insert AFTER INSERT ON tweets_tweet {when_new} BEGIN
+        INSERT INTO {table}(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER {table}_delete AFTER DELETE ON tweets_tweet {when_old} BEGIN
+        INSERT INTO {table}({table}, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER {table}_update AFTER UPDATE OF content ON tweets_tweet
+    {when_old} BEGIN
+        INSERT INTO {table}({table}, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO {table}(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+]
+DROP_TRIGGER_SQL = [
+    "DROP TRIGGER IF EXISTS {table}_insert",
+    "DROP TRIGGER IF EXISTS {table}_delete",
+    "DROP TRIGGER IF EXISTS {table}_update",
+]
+
+
+def execute_all(cursor, statements, **kwargs):
+    for sql in statements:
+        cursor.execute(sql.format(**kwargs))
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the full-text search index of tweets into a shadow table in "
+        "batches and swap it in."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        # 影のテーブルにバッチごとにコミットしながら入れ、最後に短いトランザクションで
+        # 差し替える。それまでは古い索引で検索でき、書き込みもバッチの合間に通る
+        # 入れ終わった範囲 (id <= last_pk) への書き込みはトリガーで影のテーブルにも反映する
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.drop_shadow(cursor)
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {SHADOW_TABLE} USING fts5("
+                f"content, content='{TWEET_TABLE}', content_rowid='id', "
+                "tokenize='trigram')"
+            )
+            cursor.execute(f"CREATE TABLE {STATE_TABLE} (last_pk INTEGER NOT NULL)")
+            cursor.execute(f"INSERT INTO {STATE_TABLE} (last_pk) VALUES (0)")
+            last_pk_sql = f"(SELECT last_pk FROM {STATE_TABLE})"
+            execute_all(
+                cursor,
+                TRIGGER_SQL,
+                table=SHADOW_TABLE,
+                when_new=f"WHEN new.id <= {last_pk_sql}",
+                when_old=f"WHEN old.id <= {last_pk_sql}",
+            )
+
+        indexed = 0
+        last_pk = 0
+        while True:
+            # バッチの最後の id。残りが batch_size 未満なら差し替えのときに入れる
+            upper_pk = (
+                Tweet.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[batch_size - 1 : batch_size]
+                .first()
+            )
+            if upper_pk is None:
+                break
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"UPDATE {STATE_TABLE} SET last_pk = %s", [upper_pk])
+                indexed += self.copy(cursor, last_pk, upper_pk)
+            last_pk = upper_pk
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            indexed += self.copy(cursor, last_pk)
+            execute_all(cursor, DROP_TRIGGER_SQL, table=SHADOW_TABLE)
+            execute_all(cursor, DROP_TRIGGER_SQL, table=FTS_TABLE)
+            cursor.execute(f"DROP TABLE {FTS_TABLE}")
+            cursor.execute(f"ALTER TABLE {SHADOW_TABLE} RENAME TO {FTS_TABLE}")
+            cursor.execute(f"DROP TABLE {STATE_TABLE}")
+            execute_all(cursor, TRIGGER_SQL, table=FTS_TABLE, when_new="", when_old="")
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        self.stdout.write(f"Indexed {indexed} tweets.")
+
+    def copy(self, cursor, last_pk, upper_pk=None):
+        sql = (
+            f"INSERT INTO {SHADOW_TABLE}(rowid, content) "
+            f"SELECT id, content FROM {TWEET_TABLE} WHERE id > %s"
+        )
+        params = [last_pk]
+        if upper_pk is not None:
+            sql += " AND id <= %s"
+            params.append(upper_pk)
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+    def drop_shadow(self, cursor):
+        # 前回の再構築が途中で止まっていたときの残り
+        execute_all(cursor, DROP_TRIGGER_SQL, table=SHADOW_TABLE)
+        cursor.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE}")
+        cursor.execute(f"DROP TABLE IF EXISTS {STATE_TABLE}")
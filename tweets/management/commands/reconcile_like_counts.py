@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from tweets.models import Like, Tweet
+
+
+class Command(BaseCommand):
+    help = "Recount Tweet.like_count from the Like table in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        counts = (
+            Like.objects.filter(tweet=OuterRef("pk"))
+            .values("tweet")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        last_pk = 0
+        fixed = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    Tweet.objects.filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .annotate(actual=Count("like"))
+                    .values_list("pk", "like_count", "actual")[:batch_size]
+                )
+                if not rows:
+                    break
+                stale = [pk for pk, like_count, actual in rows if like_count != actual]
+                if stale:
+                    # 読み取り後の増減も拾えるよう UPDATE 内で数え直す
+                    fixed += Tweet.objects.filter(pk__in=stale).update(
+                        like_count=Coalesce(Subquery(counts), 0),
+                        like_updated_at=timezone.now(),
+                    )
+            last_pk = rows[-1][0]
+        self.stdout.write(f"Reconciled like_count of {fixed} tweets.")
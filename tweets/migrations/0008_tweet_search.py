@@ -0,0 +1,49 @@
+from django.db import migrations
+
+# Tweet.content の FTS5 索引 (外部コンテンツテーブル)。trigram で日本語の部分一致も引ける
+# tweets_tweet への INSERT/DELETE/UPDATE OF content はトリガーで索引に反映する
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE tweets_tweet_fts USING fts5(
+        content, content='tweets_tweet', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER tweets_tweet_fts_insert AFTER INSERT ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER tweets_tweet_fts_delete AFTER DELETE ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_fts(tweets_tweet_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER tweets_tweet_fts_update AFTER UPDATE OF content ON tweets_tweet
+    BEGIN
+        INSERT INTO tweets_tweet_fts(tweets_tweet_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO tweets_tweet_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO tweets_tweet_fts(tweets_tweet_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS tweets_tweet_fts_update",
+    "DROP TRIGGER IF EXISTS tweets_tweet_fts_delete",
+    "DROP TRIGGER IF EXISTS tweets_tweet_fts_insert",
+    "DROP TABLE IF EXISTS tweets_tweet_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0007_tweet_like_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SQL, DROP_SQL),
+    ]
@@ -1,5 +1,9 @@
+from collections import Counter, defaultdict
+
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 
 
 User = get_user_model()
@@ -9,15 +13,177 @@ class Tweet(models.Model):
     content = models.TextField(max_length=140)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    like_count = models.PositiveIntegerField(default=0)
+    like_updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="tweet_created_id_idx"),
+            models.Index(
+                fields=["user", "-created_at", "-id"], name="tweet_user_created_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.content
 
 
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User, related_name="timeline_entries", on_delete=models.CASCADE
+    )
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "tweet"], name="timeline_unique"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-created_at", "-tweet"],
+                name="timeline_user_created_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user}timeline{self.tweet}"
+
+
+class HashTag(models.Model):
+    tag = models.CharField(max_length=100)
+    tweet = models.ForeignKey(Tweet, related_name="hashtags", on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tag", "tweet"], name="hashtag_unique"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["tag", "-created_at", "-tweet"],
+                name="hashtag_tag_created_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"#{self.tag}"
+
+
+class Mention(models.Model):
+    user = models.ForeignKey(User, related_name="mentions", on_delete=models.CASCADE)
+    tweet = models.ForeignKey(Tweet, related_name="mentions", on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "tweet"], name="mention_unique"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-created_at", "-tweet"],
+                name="mention_user_created_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.tweet}mention{self.user}"
+
+
+class LikeManager(models.Manager):
+    def like(self, user, tweet):
+        with transaction.atomic():
+            _, created = self.get_or_create(user=user, tweet=tweet)
+            if created:
+                Tweet.objects.filter(pk=tweet.pk).update(
+                    like_count=F("like_count") + 1, like_updated_at=timezone.now()
+                )
+        return created
+
+    def unlike(self, user, tweet):
+        with transaction.atomic():
+            deleted, _ = self.filter(user=user, tweet=tweet).delete()
+            if deleted:
+                Tweet.objects.filter(pk=tweet.pk).update(
+                    like_count=F("like_count") - 1, like_updated_at=timezone.now()
+                )
+        return bool(deleted)
+
+    def apply(self, likes=(), unlikes=()):
+        # likes / unlikes: (user_id, tweet_id) の集合をまとめて反映し、ツイートごとの増減を返す
+        likes, unlikes = set(likes), set(unlikes)
+        deltas = Counter()
+        with transaction.atomic():
+            tweet_ids = {tweet_id for _, tweet_id in likes}
+            user_ids = {user_id for user_id, _ in likes}
+            tweet_ids &= set(
+                Tweet.objects.filter(pk__in=tweet_ids).values_list("pk", flat=True)
+            )
+            user_ids &= set(
+                User.objects.filter(pk__in=user_ids).values_list("pk", flat=True)
+            )
+            likes = {
+                (user_id, tweet_id)
+                for user_id, tweet_id in likes
+                if user_id in user_ids and tweet_id in tweet_ids
+            }
+            created = likes - self._existing(likes).keys()
+            self.bulk_create(
+                [
+                    self.model(user_id=user_id, tweet_id=tweet_id)
+                    for user_id, tweet_id in created
+                ],
+                ignore_conflicts=True,
+            )
+            for _, tweet_id in created:
+                deltas[tweet_id] += 1
+
+            deleted = self._existing(unlikes)
+            if deleted:
+                self.filter(pk__in=deleted.values()).delete()
+            for _, tweet_id in deleted:
+                deltas[tweet_id] -= 1
+
+            by_delta = defaultdict(list)
+            for tweet_id, delta in deltas.items():
+                if delta:
+                    by_delta[delta].append(tweet_id)
+            for delta, tweet_ids in by_delta.items():
+                Tweet.objects.filter(pk__in=tweet_ids).update(
+                    like_count=F("like_count") + delta, like_updated_at=timezone.now()
+                )
+        return deltas
+
+    def _existing(self, pairs):
+        if not pairs:
+            return {}
+        rows = self.filter(
+            user_id__in={user_id for user_id, _ in pairs},
+            tweet_id__in={tweet_id for _, tweet_id in pairs},
+        ).values_list("user_id", "tweet_id", "pk")
+        return {
+            (user_id, tweet_id): pk
+            for user_id, tweet_id, pk in rows
+            if (user_id, tweet_id) in pairs
+        }
+
+    def liked_tweet_ids(self, user, tweets):
+        tweet_ids = [tweet.pk for tweet in tweets]
+        if not user.is_authenticated or not tweet_ids:
+            return set()
+        return set(
+            self.filter(user=user, tweet_id__in=tweet_ids).values_list(
+                "tweet_id", flat=True
+            )
+        )
+
+
 class Like(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
 
+    objects = LikeManager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection
+
+from mysite.pagination import CursorPage, InvalidCursor, decode_cursor, encode_cursor
+
+from .models import Tweet
+
+FTS_TABLE = "tweets_tweet_fts"
+# trigram トークナイザは 3 文字未満の語を MATCH で引けないので、その語は LIKE で絞り込む
+# 3 文字以上の語がなく LIKE だけになる検索は、全件を走査しないよう
+# 新しい SEARCH_SHORT_TERM_WINDOW 件のツイートの中だけを探す
+MIN_MATCH_LENGTH = 3
+
+
+def match_expression(terms):
+    # 語をそれぞれ引用符で囲み、FTS5 の演算子として解釈させない (空白区切りは AND)
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def decode(cursor):
+    values = decode_cursor(cursor)
+    try:
+        score, pk = values
+        return float(score), int(pk)
+    except (TypeError, ValueError, ValidationError):
+        raise InvalidCursor(cursor)
+
+
+def search_tweets(query, cursor=None, page_size=20):
+    # bm25 の rank 順 (同点は新しい順) に並べ、(rank, id) をキーにした keyset ページネーション
+    terms = query.split()
+    if not terms:
+        return CursorPage([], None)
+    match_terms = [term for term in terms if len(term) >= MIN_MATCH_LENGTH]
+    like_terms = [term for term in terms if len(term) < MIN_MATCH_LENGTH]
+
+    conditions, params = [], []
+    if match_terms:
+        score = "rank"
+        conditions.append(f"{FTS_TABLE} MATCH %s")
+        params.append(match_expression(match_terms))
+    else:
+        score = "0.0"
+        conditions.append(
+            "rowid > (SELECT COALESCE(MAX(id), 0) FROM tweets_tweet) - %s"
+        )
+        params.append(settings.SEARCH_SHORT_TERM_WINDOW)
+    for term in like_terms:
+        conditions.append("content LIKE %s ESCAPE '\\'")
+        params.append(like_pattern(term))
+    if cursor:
+        after_score, after_pk = decode(cursor)
+        conditions.append(f"({score} > %s OR ({score} = %s AND rowid < %s))")
+        params += [after_score, after_score, after_pk]
+    sql = (
+        f"SELECT rowid, {score} FROM {FTS_TABLE} WHERE {' AND '.join(conditions)} "
+        f"ORDER BY {score}, rowid DESC LIMIT %s"
+    )
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params + [page_size + 1])
+        rows = db_cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor([rows[-1][1], rows[-1][0]])
+    tweets = Tweet.objects.select_related("user").in_bulk([pk for pk, _ in rows])
+    return CursorPage([tweets[pk] for pk, _ in rows if pk in tweets], next_cursor)
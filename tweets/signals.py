@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .fragments import tweet_row_cache
+from .models import Tweet
+
+
+@receiver(post_delete, sender=Tweet)
+def invalidate_tweet_row(sender, instance, **kwargs):
+    tweet_row_cache.invalidate(instance)
@@ -1,7 +1,38 @@
+import json
+import sys
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
-from django.test import TestCase
-from django.urls import reverse
-from .models import Tweet, Like
+from django.core.management import call_command
+from django.db import connection
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404
+from django.template import Context, Template
+from django.test import (
+    AsyncClient,
+    AsyncRequestFactory,
+    RequestFactory,
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, reverse
+
+from accounts.models import FriendShip
+from mysite.middleware import frame_label, profile_store, profile_token
+from mysite.pagination import decode_cursor
+from . import timeline, views
+from .buffer import like_buffer
+from .management.commands.rebuild_tweet_search import (
+    Command as RebuildSearchCommand,
+)
+from .fragments import tweet_row_cache
+from .live import LikeCountBroker, like_count_broker
+from .entities import parse_hashtags, parse_mentions
+from .models import HashTag, Mention, Tweet, Like, TimelineEntry
 
 CustomUser = get_user_model()
 
@@ -62,6 +93,46 @@ class TestTweetDetailView(TestCase):
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, "tweets/tweet_detail.html")
         self.assertContains(response, self.tweet)
+        self.assertEqual(response.context["like_list"], set())
+
+    # いいね済みのツイートにリクエストを送信
+    def test_get_success_with_liked_tweet(self):
+        Like.objects.like(self.user, self.tweet)
+        response = self.client.get(
+            reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        )
+        self.assertEqual(response.context["like_list"], {self.tweet.pk})
+        self.assertContains(response, 'data-is_liked="true"')
+
+    def test_get_not_modified(self):
+        # 変化がなければテンプレートを描画せずに 304 を返す
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        # セッション・ログインユーザー・検証用の 1 件のみ
+        with self.assertNumQueries(3):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # いいねすると 200 を返す
+        Like.objects.like(self.user, self.tweet)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'data-is_liked="true"')
+
+    def test_get_etag_differs_by_viewer(self):
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(
+            CustomUser.objects.create_user(username="user2", email="test2@example.com")
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_failure_with_not_exist_tweet(self):
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": 100}))
+        self.assertEqual(response.status_code, 404)
 
 
 class TestTweetDeleteView(TestCase):
@@ -120,6 +191,9 @@ class TestFavoriteView(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Like.objects.exists())
+        self.assertEqual(response.json()["like_count"], 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
 
     def test_post_failure_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:like", kwargs={"pk": 2}))
@@ -134,6 +208,7 @@ class TestFavoriteView(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Like.objects.count(), 1)
+        self.assertEqual(response.json()["like_count"], 1)
 
 
 class TestUnfavoriteView(TestCase):
@@ -154,6 +229,7 @@ class TestUnfavoriteView(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertFalse(Like.objects.exists())
+        self.assertEqual(response.json()["like_count"], 0)
 
     def test_post_failure_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:unlike", kwargs={"pk": 2}))
@@ -167,3 +243,1001 @@ class TestUnfavoriteView(TestCase):
             reverse("tweets:unlike", kwargs={"pk": self.tweet.pk})
         )
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["like_count"], 0)
+
+
+class TestReconcileLikeCountsCommand(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.tweets = [
+            Tweet.objects.create(user=self.user, content=f"test{i}") for i in range(5)
+        ]
+        for tweet in self.tweets[:3]:
+            Like.objects.like(self.user, tweet)
+
+    def test_reconcile(self):
+        # ずれたカウンタを Like テーブルの件数に合わせる
+        Tweet.objects.filter(pk=self.tweets[0].pk).update(like_count=10)
+        Tweet.objects.filter(pk=self.tweets[4].pk).update(like_count=2)
+        out = StringIO()
+        call_command("reconcile_like_counts", batch_size=2, stdout=out)
+        self.assertIn("2 tweets", out.getvalue())
+        self.assertEqual(
+            [tweet.like_count for tweet in Tweet.objects.order_by("pk")],
+            [1, 1, 1, 0, 0],
+        )
+
+
+@override_settings(HOME_TIMELINE_ENGINE="fanout")
+class TestFanoutTimeline(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.user2 = CustomUser.objects.create_user(
+            username="another_user", email="test2@example.com"
+        )
+        self.user3 = CustomUser.objects.create_user(
+            username="third_user", email="test3@example.com"
+        )
+        FriendShip.objects.create(following=self.user2, follower=self.user)
+        self.client.force_login(self.user2)
+
+    def test_fan_out_on_create(self):
+        # ツイートすると本人とフォロワーのタイムラインに追加される
+        self.client.post(reverse("tweets:create"), {"content": "hello"})
+        tweet = Tweet.objects.get()
+        self.assertEqual(
+            set(
+                TimelineEntry.objects.filter(tweet=tweet).values_list("user", flat=True)
+            ),
+            {self.user.pk, self.user2.pk},
+        )
+
+    def test_remove_on_delete(self):
+        # ツイートを削除するとタイムラインからも消える
+        self.client.post(reverse("tweets:create"), {"content": "hello"})
+        tweet = Tweet.objects.get()
+        self.client.post(reverse("tweets:delete", kwargs={"pk": tweet.pk}))
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_backfill_and_remove_on_follow(self):
+        # フォローで直近のツイートを取り込み、フォロー解除で取り除く
+        tweets = [
+            Tweet.objects.create(user=self.user3, content=f"test{i}") for i in range(3)
+        ]
+        self.client.post(reverse("accounts:follow", kwargs={"username": "third_user"}))
+        self.assertEqual(
+            set(
+                TimelineEntry.objects.filter(user=self.user2).values_list(
+                    "tweet", flat=True
+                )
+            ),
+            {tweet.pk for tweet in tweets},
+        )
+        self.client.post(
+            reverse("accounts:unfollow", kwargs={"username": "third_user"})
+        )
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user2).exists())
+
+    def test_no_entries_with_other_engines(self):
+        # fanout 以外のエンジンではツイート・フォローで書き込まない
+        for engine in ["global", "merge"]:
+            with self.subTest(engine=engine), self.settings(
+                HOME_TIMELINE_ENGINE=engine
+            ):
+                Tweet.objects.create(user=self.user3, content="test")
+                self.client.post(reverse("tweets:create"), {"content": "hello"})
+                self.client.post(
+                    reverse("accounts:follow", kwargs={"username": "third_user"})
+                )
+                self.assertFalse(TimelineEntry.objects.exists())
+                self.client.post(
+                    reverse("accounts:unfollow", kwargs={"username": "third_user"})
+                )
+
+    def test_rebuild_timelines(self):
+        # 書き込み時に展開したのと同じエントリーを作り直す
+        with self.settings(HOME_TIMELINE_ENGINE="global"):
+            self.client.post(reverse("tweets:create"), {"content": "hello"})
+        other = Tweet.objects.create(user=self.user3, content="not followed")
+        self.client.post(reverse("tweets:create"), {"content": "fanned out"})
+        expected = set(TimelineEntry.objects.values_list("user", "tweet", "created_at"))
+        call_command("rebuild_timelines", batch_size=2, stdout=StringIO())
+        entries = set(TimelineEntry.objects.values_list("user", "tweet", "created_at"))
+        tweets = Tweet.objects.filter(user=self.user2)
+        self.assertEqual(
+            entries,
+            {
+                (user.pk, tweet.pk, tweet.created_at)
+                for user in [self.user, self.user2]
+                for tweet in tweets
+            }
+            | {(self.user3.pk, other.pk, other.created_at)},
+        )
+        self.assertLess(expected, entries)
+
+    @override_settings(HOME_TIMELINE_ENGINE="fanout", TIMELINE_PAGE_SIZE=2)
+    def test_home_with_fanout_engine(self):
+        # フォロー中のユーザーのツイートだけがホームに表示される
+        for i in range(3):
+            self.client.post(reverse("tweets:create"), {"content": f"test{i}"})
+        Tweet.objects.create(user=self.user3, content="not followed")
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("accounts:home"))
+        self.assertEqual(
+            [tweet.content for tweet in response.context["tweet_list"]],
+            ["test2", "test1"],
+        )
+        response = self.client.get(
+            reverse("accounts:home"), {"cursor": response.context["next_cursor"]}
+        )
+        self.assertEqual(
+            [tweet.content for tweet in response.context["tweet_list"]], ["test0"]
+        )
+        self.assertIsNone(response.context["next_cursor"])
+
+
+@override_settings(HOME_TIMELINE_ENGINE="merge", TIMELINE_PAGE_SIZE=2)
+class TestMergeTimeline(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.user2 = CustomUser.objects.create_user(
+            username="another_user", email="test2@example.com"
+        )
+        self.user3 = CustomUser.objects.create_user(
+            username="third_user", email="test3@example.com"
+        )
+        self.user4 = CustomUser.objects.create_user(
+            username="fourth_user", email="test4@example.com"
+        )
+        FriendShip.objects.create(following=self.user2, follower=self.user)
+        FriendShip.objects.create(following=self.user3, follower=self.user)
+        self.client.force_login(self.user)
+
+    def test_merge_followed_users(self):
+        # フォロー中のユーザーのツイートを新しい順にマージして全件たどる
+        Tweet.objects.create(user=self.user3, content="old")
+        for i in range(4):
+            Tweet.objects.create(user=self.user2, content=f"test{i}")
+        Tweet.objects.create(user=self.user, content="mine")
+        Tweet.objects.create(user=self.user4, content="not followed")
+        contents = []
+        response = self.client.get(reverse("accounts:home"))
+        while True:
+            self.assertEqual(response.status_code, 200)
+            contents += [tweet.content for tweet in response.context["tweet_list"]]
+            cursor = response.context["next_cursor"]
+            if cursor is None:
+                break
+            response = self.client.get(reverse("accounts:home"), {"cursor": cursor})
+        self.assertEqual(contents, ["mine", "test3", "test2", "test1", "test0", "old"])
+
+    def test_read_only_leading_authors(self):
+        # 1 ページ目は全員をまとめて読み、以降はカーソルのユーザーごとの位置から
+        # 次のツイートが新しい上位 page_size 人だけを読む (+ ページのツイートを 1 クエリ)
+        Tweet.objects.create(user=self.user3, content="only")
+        for i in range(4):
+            Tweet.objects.create(user=self.user2, content=f"test{i}")
+        for i in range(10):
+            followed = CustomUser.objects.create_user(
+                username=f"followed{i}", email=f"followed{i}@example.com"
+            )
+            FriendShip.objects.create(following=followed, follower=self.user)
+        engine = timeline.MergeTimeline()
+        with self.settings(TIMELINE_MERGE_BATCH_SIZE=5):
+            # FriendShip、13 人分を 5 人ずつ、ページのツイート
+            with self.assertNumQueries(5):
+                page = engine.page(self.user, None, 2)
+        contents = [tweet.content for tweet in page]
+        self.assertEqual(
+            [author_id for author_id, _, _ in decode_cursor(page.next_cursor)["p"]],
+            [self.user2.pk, self.user3.pk],
+        )
+        # 1 ページ目の後の投稿は、続きのページに割り込まない
+        Tweet.objects.create(user=self.user2, content="new")
+        cursor = page.next_cursor
+        while cursor:
+            with self.assertNumQueries(2):
+                page = engine.page(self.user, cursor, 2)
+            contents += [tweet.content for tweet in page]
+            cursor = page.next_cursor
+        self.assertEqual(contents, ["test3", "test2", "test1", "test0", "only"])
+
+    def test_page_with_fields(self):
+        Tweet.objects.create(user=self.user3, content="old")
+        for i in range(2):
+            Tweet.objects.create(user=self.user2, content=f"test{i}")
+        engine = timeline.MergeTimeline()
+        page = engine.page(self.user, None, 2, fields=["id", "created_at", "user_id"])
+        page = engine.page(
+            self.user, page.next_cursor, 2, fields=["id", "created_at", "user_id"]
+        )
+        self.assertEqual([tweet["user_id"] for tweet in page], [self.user3.pk])
+        self.assertIsNone(page.next_cursor)
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(reverse("accounts:home"), {"cursor": "e30"})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(
+    LIKE_BUFFER_ENABLED=True, LIKE_BUFFER_MAX_SIZE=3, LIKE_BUFFER_FLUSH_INTERVAL=0
+)
+class TestLikeBuffer(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.user2 = CustomUser.objects.create_user(
+            username="another_user", email="test2@example.com"
+        )
+        self.tweet = Tweet.objects.create(user=self.user2, content="test")
+        self.tweet2 = Tweet.objects.create(user=self.user2, content="test2")
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        like_buffer.flush()
+
+    def test_optimistic_count_and_flush(self):
+        # フラッシュまでは書き込まず、レスポンスには見込みの件数を返す
+        response = self.client.post(
+            reverse("tweets:like", kwargs={"pk": self.tweet.pk})
+        )
+        self.assertEqual(response.json()["like_count"], 1)
+        self.assertFalse(Like.objects.exists())
+        like_buffer.flush()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+        self.assertTrue(Like.objects.filter(user=self.user, tweet=self.tweet).exists())
+
+    def test_cancel_like_and_unlike(self):
+        # 同じウィンドウ内のいいねと解除は打ち消し合い、何も書き込まない
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        response = self.client.post(
+            reverse("tweets:unlike", kwargs={"pk": self.tweet.pk})
+        )
+        self.assertEqual(response.json()["like_count"], 0)
+        with CaptureQueriesContext(connection) as queries:
+            like_buffer.flush()
+        self.assertFalse(
+            [q for q in queries if q["sql"].startswith(("INSERT", "UPDATE", "DELETE"))]
+        )
+        self.assertFalse(Like.objects.exists())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+
+    def test_no_delta_without_state_change(self):
+        # いいね済みのツイートへの いいね は件数を変えない
+        Like.objects.like(self.user, self.tweet)
+        response = self.client.post(
+            reverse("tweets:like", kwargs={"pk": self.tweet.pk})
+        )
+        self.assertEqual(response.json()["like_count"], 1)
+        response = self.client.post(
+            reverse("tweets:unlike", kwargs={"pk": self.tweet2.pk})
+        )
+        self.assertEqual(response.json()["like_count"], 0)
+        response = self.client.post(
+            reverse("tweets:unlike", kwargs={"pk": self.tweet.pk})
+        )
+        self.assertEqual(response.json()["like_count"], 0)
+        like_buffer.flush()
+        self.assertFalse(Like.objects.exists())
+
+    def test_flush_at_max_size(self):
+        # 上限に達したらその場でフラッシュする
+        Like.objects.like(self.user2, self.tweet)
+        like_buffer.add(self.user.pk, self.tweet.pk, True)
+        like_buffer.add(self.user.pk, self.tweet2.pk, True)
+        like_buffer.add(self.user2.pk, self.tweet.pk, False)
+        self.assertEqual(len(like_buffer), 0)
+        self.assertEqual(
+            dict(Tweet.objects.values_list("pk", "like_count")),
+            {self.tweet.pk: 1, self.tweet2.pk: 1},
+        )
+
+
+class TestLikeBatchView(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.user2 = CustomUser.objects.create_user(
+            username="another_user", email="test2@example.com"
+        )
+        self.tweets = [
+            Tweet.objects.create(user=self.user2, content=f"test{i}") for i in range(3)
+        ]
+        Like.objects.like(self.user, self.tweets[2])
+        self.client.force_login(self.user)
+
+    def post(self, operations):
+        return self.client.post(
+            reverse("tweets:like_batch"),
+            json.dumps({"operations": operations}),
+            content_type="application/json",
+        )
+
+    def test_post_success(self):
+        # 複数の いいね/解除 を1回のリクエストで反映し、件数をまとめて返す
+        response = self.post(
+            [
+                {"tweet_pk": self.tweets[0].pk, "action": "like"},
+                {"tweet_pk": self.tweets[1].pk, "action": "like"},
+                {"tweet_pk": self.tweets[1].pk, "action": "unlike"},
+                {"tweet_pk": self.tweets[2].pk, "action": "unlike"},
+                {"tweet_pk": 100, "action": "like"},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(response.json()["tweets"], key=lambda tweet: tweet["tweet_pk"]),
+            [
+                {"tweet_pk": self.tweets[0].pk, "like_count": 1},
+                {"tweet_pk": self.tweets[1].pk, "like_count": 0},
+                {"tweet_pk": self.tweets[2].pk, "like_count": 0},
+            ],
+        )
+        self.assertEqual(
+            list(Like.objects.values_list("tweet", flat=True)), [self.tweets[0].pk]
+        )
+
+    def test_post_failure_with_invalid_action(self):
+        response = self.post([{"tweet_pk": self.tweets[0].pk, "action": "retweet"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_post_failure_with_too_many_operations(self):
+        operations = [{"tweet_pk": self.tweets[0].pk, "action": "like"}] * 101
+        response = self.post(operations)
+        self.assertEqual(response.status_code, 400)
+
+
+class TestLikeCountView(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.user2 = CustomUser.objects.create_user(
+            username="another_user", email="test2@example.com"
+        )
+        self.tweets = [
+            Tweet.objects.create(user=self.user2, content=f"test{i}") for i in range(3)
+        ]
+        Like.objects.like(self.user, self.tweets[0])
+        Like.objects.like(self.user2, self.tweets[0])
+        Like.objects.like(self.user2, self.tweets[1])
+        self.client.force_login(self.user)
+        self.ids = ",".join(str(tweet.pk) for tweet in self.tweets)
+
+    def test_get_success(self):
+        # いいね数と自分がいいね済みかどうかをまとめて返す
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("tweets:like_counts"), {"ids": self.ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["tweets"],
+            [
+                {"tweet_pk": self.tweets[0].pk, "like_count": 2, "is_liked": True},
+                {"tweet_pk": self.tweets[1].pk, "like_count": 1, "is_liked": False},
+                {"tweet_pk": self.tweets[2].pk, "like_count": 0, "is_liked": False},
+            ],
+        )
+
+    def test_get_not_modified(self):
+        # 変化がなければ 304、いいねが増えたら 200 を返す
+        response = self.client.get(reverse("tweets:like_counts"), {"ids": self.ids})
+        etag = response["ETag"]
+        response = self.client.get(
+            reverse("tweets:like_counts"), {"ids": self.ids}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        Like.objects.like(self.user, self.tweets[2])
+        response = self.client.get(
+            reverse("tweets:like_counts"), {"ids": self.ids}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(LIKE_BUFFER_ENABLED=True, LIKE_BUFFER_FLUSH_INTERVAL=0)
+    def test_get_with_buffered_likes(self):
+        # まだ書き込んでいない いいね/解除 も is_liked に反映する
+        self.addCleanup(like_buffer.flush)
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[1].pk}))
+        self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweets[0].pk}))
+        response = self.client.get(reverse("tweets:like_counts"), {"ids": self.ids})
+        self.assertEqual(
+            response.json()["tweets"],
+            [
+                {"tweet_pk": self.tweets[0].pk, "like_count": 1, "is_liked": False},
+                {"tweet_pk": self.tweets[1].pk, "like_count": 2, "is_liked": True},
+                {"tweet_pk": self.tweets[2].pk, "like_count": 0, "is_liked": False},
+            ],
+        )
+
+    def test_get_failure_with_invalid_ids(self):
+        response = self.client.get(reverse("tweets:like_counts"), {"ids": "1,a"})
+        self.assertEqual(response.status_code, 400)
+        ids = ",".join(str(pk) for pk in range(1, 302))
+        response = self.client.get(reverse("tweets:like_counts"), {"ids": ids})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestTweetRowCache(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.user2 = CustomUser.objects.create_user(
+            username="another_user", email="test2@example.com"
+        )
+        self.tweets = [
+            Tweet.objects.create(user=self.user2, content=f"test{i}") for i in range(3)
+        ]
+        self.client.force_login(self.user)
+
+    def get_stats_delta(self):
+        before = tweet_row_cache.stats()
+        response = self.client.get(reverse("accounts:home"))
+        after = tweet_row_cache.stats()
+        return response, {key: after[key] - before[key] for key in after}
+
+    def test_reuse_rendered_rows(self):
+        # 2回目以降は描画済みの HTML を使い回す
+        _, stats = self.get_stats_delta()
+        self.assertEqual(stats, {"hits": 0, "misses": 3})
+        self.client.force_login(self.user2)
+        response, stats = self.get_stats_delta()
+        self.assertEqual(stats, {"hits": 3, "misses": 0})
+        self.assertContains(response, "test2")
+
+    def test_new_version_on_like(self):
+        # いいねされたツイートだけ描画し直し、いいねボタンは閲覧者ごとに描画する
+        self.get_stats_delta()
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[0].pk}))
+        response, stats = self.get_stats_delta()
+        self.assertEqual(stats, {"hits": 2, "misses": 1})
+        self.assertContains(
+            response, f'<span id="js-like-for-tweet-count-{self.tweets[0].pk}">1</span>'
+        )
+        self.assertContains(response, 'data-is_liked="true"', count=1)
+        self.client.force_login(self.user2)
+        response, stats = self.get_stats_delta()
+        self.assertEqual(stats, {"hits": 3, "misses": 0})
+        self.assertNotContains(response, 'data-is_liked="true"')
+
+    def test_new_version_on_rename(self):
+        # 投稿者のユーザー名を変えたら、その投稿者の行を描画し直す
+        self.get_stats_delta()
+        self.user2.username = "renamed_user"
+        self.user2.save()
+        response, stats = self.get_stats_delta()
+        self.assertEqual(stats, {"hits": 0, "misses": 3})
+        self.assertContains(response, "renamed_user", count=3)
+        self.assertNotContains(response, "another_user")
+
+
+class TestAsyncLikeView(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.user2 = CustomUser.objects.create_user(
+            username="another_user", email="test2@example.com"
+        )
+        self.tweet = Tweet.objects.create(user=self.user2, content="test")
+        self.factory = AsyncRequestFactory()
+
+    async def post(self, view, pk, user=None):
+        request = self.factory.post(reverse("tweets:like", kwargs={"pk": pk}))
+        request.user = user or self.user
+        return await view.as_view()(request, pk=pk)
+
+    async def test_post_success(self):
+        # 非同期ビューで いいね/解除 する
+        response = await self.post(views.AsyncLikeView, self.tweet.pk)
+        self.assertEqual(json.loads(response.content)["like_count"], 1)
+        self.assertTrue(await Like.objects.filter(user=self.user).aexists())
+        response = await self.post(views.AsyncUnlikeView, self.tweet.pk)
+        self.assertEqual(json.loads(response.content)["like_count"], 0)
+        self.assertFalse(await Like.objects.aexists())
+
+    @override_settings(LIKE_BUFFER_ENABLED=True, LIKE_BUFFER_FLUSH_INTERVAL=0)
+    async def test_post_buffered(self):
+        await sync_to_async(Like.objects.like)(self.user, self.tweet)
+        # いいね済みなので見込みの件数は増えない
+        response = await self.post(views.AsyncLikeView, self.tweet.pk)
+        self.assertEqual(json.loads(response.content)["like_count"], 1)
+        await sync_to_async(like_buffer.flush)()
+
+    async def test_post_failure_with_not_exist_tweet(self):
+        with self.assertRaises(Http404):
+            await self.post(views.AsyncLikeView, 100)
+
+    async def test_post_failure_with_anonymous_user(self):
+        response = await self.post(views.AsyncLikeView, self.tweet.pk, AnonymousUser())
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(await Like.objects.aexists())
+
+
+class TestLikeCountBroker(TestCase):
+    async def test_dispatch_coalesces_updates(self):
+        broker = LikeCountBroker()
+        subscription = broker.subscribe({1, 2})
+        # 購読されていないツイートの更新は捨てる
+        broker.publish(3, 1, 1)
+        broker.publish(1, 1, 5)
+        broker.publish(1, 1, 6)
+        broker.publish(2, -1, 0)
+        self.assertEqual(await subscription.next(0), [])
+
+        # tick ごとにツイート単位で増減を合算する
+        broker.dispatch()
+        self.assertEqual(
+            await subscription.next(0),
+            [
+                {"tweet_pk": 1, "delta": 2, "like_count": 6},
+                {"tweet_pk": 2, "delta": -1, "like_count": 0},
+            ],
+        )
+        broker.unsubscribe(subscription)
+        broker.publish(1, 1, 7)
+        broker.dispatch()
+        self.assertEqual(await subscription.next(0), [])
+
+
+class TestLikeStreamView(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.user2 = CustomUser.objects.create_user(
+            username="another_user", email="test2@example.com"
+        )
+        self.tweet = Tweet.objects.create(user=self.user2, content="test")
+        self.factory = AsyncRequestFactory()
+
+    async def get(self, ids, factory=None):
+        factory = factory or self.factory
+        request = factory.get("/tweets/likes/stream/", {"ids": ids})
+        request.user = self.user
+        return await views.LikeStreamView.as_view()(request)
+
+    async def test_get_success(self):
+        response = await self.get(str(self.tweet.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+    async def test_get_failure_under_wsgi(self):
+        # WSGI では流せないので 501 を返す (URL も ASYNC_VIEWS のときだけ公開する)
+        response = await self.get(str(self.tweet.pk), RequestFactory())
+        self.assertEqual(response.status_code, 501)
+        with self.assertRaises(NoReverseMatch):
+            reverse("tweets:like_stream")
+
+    async def test_get_failure_with_invalid_ids(self):
+        for ids in ["", "a", ",".join(str(i) for i in range(301))]:
+            response = await self.get(ids)
+            self.assertEqual(response.status_code, 400)
+
+    async def test_stream_like_updates(self):
+        stream = views.LikeStreamView().stream({self.tweet.pk})
+        self.assertEqual(await anext(stream), "retry: 3000\n\n")
+
+        # いいね/解除 をまとめて 1 件のイベントとして配信する
+        await views.aupdate_like(self.user, self.tweet, True)
+        await views.aupdate_like(self.user2, self.tweet, True)
+        like_count_broker.dispatch()
+        event = await anext(stream)
+        self.assertTrue(event.startswith("event: likes\ndata: "))
+        self.assertEqual(
+            json.loads(event.split("data: ")[1]),
+            [{"tweet_pk": self.tweet.pk, "delta": 2, "like_count": 2}],
+        )
+
+        await stream.aclose()
+        self.assertNotIn(self.tweet.pk, like_count_broker._subscribers)
+
+
+@override_settings(TIMELINE_PAGE_SIZE=2)
+class TestTweetAPIView(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.user2 = CustomUser.objects.create_user(
+            username="another_user", email="test2@example.com"
+        )
+        FriendShip.objects.create(following=self.user2, follower=self.user)
+        self.tweets = [
+            Tweet.objects.create(user=self.user2, content=f"test{i}") for i in range(3)
+        ]
+        for tweet in self.tweets:
+            timeline.fan_out(tweet)
+        Tweet.objects.create(user=self.user, content="mine")
+        Like.objects.like(self.user, self.tweets[2])
+        self.client.force_login(self.user)
+
+    def test_get_tweet(self):
+        tweet = self.tweets[2]
+        response = self.client.get(
+            reverse("tweets:api_detail", kwargs={"pk": tweet.pk})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["tweet"],
+            {
+                "id": tweet.pk,
+                "content": "test2",
+                "created_at": tweet.created_at.isoformat(),
+                "like_count": 1,
+                "user": {"id": self.user2.pk, "username": "another_user"},
+            },
+        )
+        # 変化がなければ 304 を返す
+        response = self.client.get(
+            reverse("tweets:api_detail", kwargs={"pk": tweet.pk}),
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_get_tweet_failure_with_not_exist_tweet(self):
+        response = self.client.get(reverse("tweets:api_detail", kwargs={"pk": 100}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_user_tweets(self):
+        url = reverse("tweets:api_user_tweets", kwargs={"username": "another_user"})
+        # セッション・ユーザー・ユーザーの pk・ツイート
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        data = response.json()
+        self.assertEqual(
+            [tweet["content"] for tweet in data["tweets"]], ["test2", "test1"]
+        )
+        response = self.client.get(url, {"cursor": data["next_cursor"]})
+        data = response.json()
+        self.assertEqual([tweet["content"] for tweet in data["tweets"]], ["test0"])
+        self.assertIsNone(data["next_cursor"])
+
+    def test_get_user_tweets_failure(self):
+        response = self.client.get(
+            reverse("tweets:api_user_tweets", kwargs={"username": "nobody"})
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse("tweets:api_user_tweets", kwargs={"username": "another_user"}),
+            {"cursor": "invalid"},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_timeline(self):
+        for engine, contents in [
+            ("global", ["mine", "test2", "test1", "test0"]),
+            ("fanout", ["test2", "test1", "test0"]),
+            ("merge", ["mine", "test2", "test1", "test0"]),
+        ]:
+            with self.subTest(engine=engine), self.settings(
+                HOME_TIMELINE_ENGINE=engine
+            ):
+                # カーソルをたどって全件取得する
+                fetched = []
+                cursor = ""
+                while cursor is not None:
+                    response = self.client.get(
+                        reverse("tweets:api_timeline"), {"cursor": cursor}
+                    )
+                    data = response.json()
+                    fetched += [tweet["content"] for tweet in data["tweets"]]
+                    cursor = data["next_cursor"]
+                self.assertEqual(fetched, contents)
+
+    def test_get_timeline_failure_with_invalid_cursor(self):
+        response = self.client.get(reverse("tweets:api_timeline"), {"cursor": "x"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(TIMELINE_PAGE_SIZE=2)
+class TestTweetSearchView(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.client.force_login(self.user)
+        self.tweets = [
+            Tweet.objects.create(user=self.user, content=content)
+            for content in [
+                "今日はいい天気ですね",
+                "天気が悪い",
+                "いい天気いい天気いい天気",
+                "Hello world",
+            ]
+        ]
+
+    def search(self, query, cursor=None):
+        params = {"q": query}
+        if cursor:
+            params["cursor"] = cursor
+        return self.client.get(reverse("tweets:search"), params)
+
+    def test_get_ranked_results(self):
+        # 関連度の高い順に並べ、カーソルで次のページを取得する
+        response = self.search("天気 いい天気")
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "tweets/tweet_search.html")
+        self.assertEqual(
+            list(response.context["tweet_list"]), [self.tweets[2], self.tweets[0]]
+        )
+        self.assertIsNone(response.context["next_cursor"])
+
+        response = self.search("天気")
+        self.assertEqual(len(response.context["tweet_list"]), 2)
+        next_response = self.search("天気", response.context["next_cursor"])
+        self.assertEqual(len(next_response.context["tweet_list"]), 1)
+        self.assertIsNone(next_response.context["next_cursor"])
+        self.assertEqual(
+            set(response.context["tweet_list"])
+            | set(next_response.context["tweet_list"]),
+            set(self.tweets[:3]),
+        )
+
+    def test_get_with_special_characters(self):
+        # FTS5 の構文として解釈しない・大文字小文字を区別しない
+        response = self.search('HELLO "wor* OR')
+        self.assertEqual(list(response.context["tweet_list"]), [])
+        response = self.search("HELLO wor")
+        self.assertEqual(list(response.context["tweet_list"]), [self.tweets[3]])
+        response = self.search("")
+        self.assertEqual(list(response.context["tweet_list"]), [])
+
+    def test_index_follows_update_and_delete(self):
+        self.tweets[3].content = "Goodbye world"
+        self.tweets[3].save()
+        self.assertEqual(list(self.search("hello").context["tweet_list"]), [])
+        self.assertEqual(
+            list(self.search("goodbye").context["tweet_list"]), [self.tweets[3]]
+        )
+        self.tweets[3].delete()
+        self.assertEqual(list(self.search("goodbye").context["tweet_list"]), [])
+
+    def test_get_short_terms(self):
+        # 2 文字の語は LIKE で探す。3 文字以上の語がなければ新しいツイートの範囲だけ
+        response = self.search("天気")
+        self.assertEqual(len(response.context["tweet_list"]), 2)
+        with override_settings(SEARCH_SHORT_TERM_WINDOW=2):
+            response = self.search("天気")
+            self.assertEqual(list(response.context["tweet_list"]), [self.tweets[2]])
+            response = self.search("今日は 天気")
+            self.assertEqual(list(response.context["tweet_list"]), [self.tweets[0]])
+
+    def test_get_failure_with_invalid_cursor(self):
+        response = self.search("天気", "invalid")
+        self.assertEqual(response.status_code, 404)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO tweets_tweet_fts(tweets_tweet_fts) VALUES ('delete-all')"
+            )
+        self.assertEqual(list(self.search("hello").context["tweet_list"]), [])
+        out = StringIO()
+        call_command("rebuild_tweet_search", batch_size=3, stdout=out)
+        self.assertIn("Indexed 4 tweets.", out.getvalue())
+        self.assertEqual(
+            list(self.search("hello").context["tweet_list"]), [self.tweets[3]]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE name LIKE '%rebuild%'")
+            self.assertEqual(cursor.fetchall(), [])
+
+    def test_rebuild_command_with_writes_between_batches(self):
+        # バッチの合間の書き込みも、入れ終わった範囲はトリガーで新しい索引に反映する
+        tweets = self.tweets
+        second_pk = tweets[1].pk
+
+        class Command(RebuildSearchCommand):
+            def copy(self, cursor, last_pk, upper_pk=None):
+                copied = super().copy(cursor, last_pk, upper_pk)
+                if upper_pk == second_pk:
+                    Tweet.objects.filter(pk=tweets[0].pk).update(content="goodbye")
+                    tweets[1].delete()
+                    tweets[3].delete()
+                    Tweet.objects.create(user=tweets[2].user, content="hello again")
+                return copied
+
+        call_command(Command(), batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            [tweet.content for tweet in self.search("goodbye").context["tweet_list"]],
+            ["goodbye"],
+        )
+        self.assertEqual(
+            [tweet.content for tweet in self.search("hello").context["tweet_list"]],
+            ["hello again"],
+        )
+        self.assertEqual(len(self.search("天気").context["tweet_list"]), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO tweets_tweet_fts(tweets_tweet_fts, rank) "
+                "VALUES ('integrity-check', 1)"
+            )
+        # 差し替えた後もトリガーが働く
+        Tweet.objects.create(user=tweets[2].user, content="welcome")
+        self.assertEqual(len(self.search("welcome").context["tweet_list"]), 1)
+
+
+@override_settings(TIMELINE_PAGE_SIZE=2)
+class TestHashTagAndMention(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="user", email="test@example.com"
+        )
+        self.user2 = CustomUser.objects.create_user(
+            username="another_user", email="test2@example.com"
+        )
+        self.client.force_login(self.user)
+
+    def test_parse(self):
+        self.assertEqual(
+            parse_hashtags("#天気 いい#no ##x #Django、#django"), {"天気", "django"}
+        )
+        self.assertEqual(
+            parse_mentions("hi @another_user. mail a@b.com @user"),
+            {"another_user", "user"},
+        )
+
+    def test_index_on_create(self):
+        # ツイート時にハッシュタグと存在するユーザーへのメンションを保存する
+        self.client.post(
+            reverse("tweets:create"),
+            {"content": "#Hello @another_user @nobody #hello #world"},
+        )
+        tweet = Tweet.objects.get()
+        self.assertEqual(
+            set(HashTag.objects.filter(tweet=tweet).values_list("tag", flat=True)),
+            {"hello", "world"},
+        )
+        self.assertEqual(
+            list(Mention.objects.filter(tweet=tweet).values_list("user", flat=True)),
+            [self.user2.pk],
+        )
+        self.assertEqual(HashTag.objects.first().created_at, tweet.created_at)
+
+    def test_hashtag_view(self):
+        for i in range(3):
+            self.client.post(reverse("tweets:create"), {"content": f"test{i} #Tag"})
+        self.client.post(reverse("tweets:create"), {"content": "#other"})
+        url = reverse("tweets:hashtag", kwargs={"tag": "TAG"})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "tweets/tweet_list.html")
+        self.assertEqual(
+            [tweet.content for tweet in response.context["tweet_list"]],
+            ["test2 #Tag", "test1 #Tag"],
+        )
+        response = self.client.get(url, {"cursor": response.context["next_cursor"]})
+        self.assertEqual(
+            [tweet.content for tweet in response.context["tweet_list"]],
+            ["test0 #Tag"],
+        )
+        self.assertIsNone(response.context["next_cursor"])
+
+    def test_mention_view(self):
+        self.client.post(reverse("tweets:create"), {"content": "hi @another_user"})
+        self.client.post(reverse("tweets:create"), {"content": "hi @user"})
+        response = self.client.get(
+            reverse("tweets:mention", kwargs={"username": "another_user"})
+        )
+        self.assertEqual(
+            [tweet.content for tweet in response.context["tweet_list"]],
+            ["hi @another_user"],
+        )
+        response = self.client.get(
+            reverse("tweets:mention", kwargs={"username": "nobody"})
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_backfill_command(self):
+        for i in range(5):
+            Tweet.objects.create(user=self.user, content=f"#tag{i % 2} @another_user")
+        out = StringIO()
+        call_command("backfill_tweet_entities", chunk_size=2, stdout=out)
+        self.assertIn(
+            "Indexed 5 hashtags and 5 mentions from 5 tweets.", out.getvalue()
+        )
+        self.assertEqual(HashTag.objects.filter(tag="tag0").count(), 3)
+        self.assertEqual(Mention.objects.filter(user=self.user2).count(), 5)
+        # 再実行しても重複しない
+        call_command("backfill_tweet_entities", stdout=StringIO())
+        self.assertEqual(HashTag.objects.count(), 5)
+
+
+class TestProfiler(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="user")
+        for i in range(20):
+            Tweet.objects.create(user=self.user, content=f"tweet {i}")
+        self.client.force_login(self.user)
+        self.directory = Path(tempfile.mkdtemp())
+        profile_store.clear()
+        self.addCleanup(profile_store.clear)
+
+    def profiles(self):
+        return sorted(path.name.split(".")[0] for path in self.directory.iterdir())
+
+    def get_home(self, times=5, **extra):
+        with override_settings(PROFILER_DIR=self.directory, PROFILER_INTERVAL=0.0001):
+            for _ in range(times):
+                self.client.get(reverse("accounts:home"), **extra)
+
+    def test_sample_rate(self):
+        with override_settings(PROFILER_SAMPLE_RATE=1.0):
+            self.get_home()
+        self.assertEqual(self.profiles(), ["accounts-home"])
+        (path,) = self.directory.iterdir()
+        lines = path.read_text().splitlines()
+        self.assertTrue(lines)
+        # collapsed 形式: "root;...;leaf 回数"
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn("mysite.middleware:__call__", path.read_text())
+
+    def test_template_frame_label(self):
+        # テンプレートの描画はテンプレート名で表す
+        labels = []
+
+        def probe():
+            frame = sys._getframe()
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+
+        Template("{{ probe }}", name="probe.html").render(Context({"probe": probe}))
+        self.assertIn("template:probe.html", labels)
+        self.assertIn("django.template.base:render", labels)
+
+    @override_settings(PROFILER_SAMPLE_RATE=1.0, PROFILER_INTERVAL=0.0001)
+    async def test_sample_rate_async(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user)
+        with override_settings(PROFILER_DIR=self.directory):
+            for _ in range(5):
+                response = await client.get(reverse("accounts:home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.profiles(), ["accounts-home"])
+
+    def test_signed_header(self):
+        self.get_home(HTTP_X_PROFILE="invalid")
+        self.assertEqual(self.profiles(), [])
+        self.get_home(HTTP_X_PROFILE=profile_token())
+        self.assertEqual(self.profiles(), ["accounts-home"])
+
+    def test_report(self):
+        (self.directory / "accounts-home.1.folded").write_text(
+            "main;view;template:home.html;render 3\nmain;view;query 1\n"
+        )
+        (self.directory / "accounts-home.2.folded").write_text(
+            "main;view;template:home.html;render 2\n"
+        )
+        (self.directory / "tweets-detail.1.folded").write_text("main;view;query 7\n")
+        merged = self.directory / "merged.txt"
+        out = StringIO()
+        call_command(
+            "profile_report",
+            dir=str(self.directory),
+            view=["accounts:home"],
+            output=str(merged),
+            stdout=out,
+        )
+        self.assertEqual(
+            merged.read_text(),
+            "main;view;query 1\nmain;view;template:home.html;render 5\n",
+        )
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "6 samples from 2 files")
+        # 自分自身のサンプル数が多い順
+        self.assertTrue(lines[2].endswith("render"))
+        self.assertIn("5  83.3%  template:home.html", out.getvalue())
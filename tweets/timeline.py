@@ -0,0 +1,260 @@
+import heapq
+from collections import Counter
+from itertools import chain, islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from accounts.models import FriendShip
+from mysite.pagination import (
+    CursorPage,
+    CursorPaginator,
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+)
+
+from .models import TimelineEntry, Tweet
+
+FRIENDSHIP_TABLE = FriendShip._meta.db_table
+TIMELINE_TABLE = TimelineEntry._meta.db_table
+TWEET_TABLE = Tweet._meta.db_table
+
+# MergeTimeline でユーザー 1 人分の新しい順の上位 N 件。bound は読み始める位置 (含む)
+# (SQLite では複合 SELECT の中に直接 ORDER BY / LIMIT を書けないので副問い合わせにする)
+AUTHOR_TWEETS_SQL = f"""
+    SELECT * FROM (
+        SELECT id FROM {TWEET_TABLE}
+        WHERE user_id = %s {{bound}}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    )
+"""
+HEAD_BOUND_SQL = """
+    AND created_at <= %s AND (created_at < %s OR (created_at = %s AND id <= %s))
+"""
+
+
+def fanout_enabled():
+    # TimelineEntry を読むのは fanout エンジンだけなので、他のエンジンでは書き込まない
+    return settings.HOME_TIMELINE_ENGINE == "fanout"
+
+
+def on_tweet_created(tweet):
+    if fanout_enabled():
+        fan_out(tweet)
+
+
+def on_follow(user, author):
+    if fanout_enabled():
+        backfill(user, author)
+
+
+def on_unfollow(user, author):
+    if fanout_enabled():
+        remove_author(user, author)
+
+
+def fan_out(tweet):
+    follower_ids = (
+        FriendShip.objects.filter(following_id=tweet.user_id)
+        .values_list("follower_id", flat=True)
+        .iterator()
+    )
+    user_ids = chain([tweet.user_id], follower_ids)
+    batch_size = settings.TIMELINE_FANOUT_BATCH_SIZE
+    while True:
+        batch = [
+            TimelineEntry(user_id=user_id, tweet=tweet, created_at=tweet.created_at)
+            for user_id in islice(user_ids, batch_size)
+        ]
+        if not batch:
+            break
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def backfill(user, author):
+    tweets = Tweet.objects.filter(user=author).order_by("-created_at", "-id")[
+        : settings.TIMELINE_BACKFILL_SIZE
+    ]
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user=user, tweet_id=tweet_id, created_at=created_at)
+            for tweet_id, created_at in tweets.values_list("id", "created_at")
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def remove_author(user, author):
+    TimelineEntry.objects.filter(user=user, tweet__user=author).delete()
+
+
+def rebuild(user_pks):
+    # fan_out で書き込んだのと同じ、本人とフォロー中のユーザーの全ツイートを入れ直す
+    user_pks = list(user_pks)
+    TimelineEntry.objects.filter(user_id__in=user_pks).delete()
+    placeholders = ", ".join(["%s"] * len(user_pks))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {TIMELINE_TABLE} (user_id, tweet_id, created_at)
+            SELECT f.follower_id, t.id, t.created_at
+            FROM {FRIENDSHIP_TABLE} f
+            JOIN {TWEET_TABLE} t ON t.user_id = f.following_id
+            WHERE f.follower_id IN ({placeholders})
+            UNION ALL
+            SELECT t.user_id, t.id, t.created_at
+            FROM {TWEET_TABLE} t
+            WHERE t.user_id IN ({placeholders})
+            """,
+            user_pks * 2,
+        )
+
+
+# page() に fields を渡すと、モデルを作らずに values(*fields) の dict を返す
+# (fields には created_at / id / user_id を含めること)
+
+
+def tweet_queryset(queryset, fields):
+    if fields:
+        return queryset.values(*fields)
+    return queryset.select_related("user")
+
+
+class GlobalTimeline:
+    def page(self, user, cursor, page_size, fields=None):
+        paginator = CursorPaginator(
+            tweet_queryset(Tweet.objects.all(), fields),
+            ("-created_at", "-id"),
+            page_size,
+        )
+        return paginator.page(cursor)
+
+
+class FanoutTimeline:
+    def page(self, user, cursor, page_size, fields=None):
+        entries = TimelineEntry.objects.filter(user=user)
+        if fields:
+            entries = entries.values("created_at", "tweet_id")
+        else:
+            entries = entries.select_related("tweet__user")
+        paginator = CursorPaginator(entries, ("-created_at", "-tweet_id"), page_size)
+        page = paginator.page(cursor)
+        if fields:
+            tweet_ids = [entry["tweet_id"] for entry in page.object_list]
+            rows = {
+                row["id"]: row
+                for row in Tweet.objects.filter(pk__in=tweet_ids).values(*fields)
+            }
+            page.object_list = [rows[pk] for pk in tweet_ids if pk in rows]
+        else:
+            page.object_list = [entry.tweet for entry in page.object_list]
+        return page
+
+
+class MergeTimeline:
+    # フォロー中のユーザーごとに新しい順の上位 N+1 件を (user, created_at) のインデックスで読み、
+    # ヒープで k-way マージする (ユーザーごとの LIMIT を UNION ALL でまとめて 1 クエリにする)
+    # マージは (created_at, id, user_id) だけで行い、ページに入ったツイートだけを読み込む
+    # カーソルは {"p": [[ユーザー id, 次に返すツイートの created_at, id], ...]} で、
+    # 読み切ったユーザーは含めない。次のツイートが新しい上位 page_size 人より後ろの
+    # ユーザーはそのページに入らないので、2 ページ目以降はその人たちだけを読む
+
+    def page(self, user, cursor, page_size, fields=None):
+        if cursor:
+            heads = self.decode(cursor)
+            author_ids = sorted(heads, key=heads.get, reverse=True)[:page_size]
+        else:
+            author_ids = [user.pk]
+            author_ids += FriendShip.objects.filter(follower=user).values_list(
+                "following_id", flat=True
+            )
+            heads = dict.fromkeys(author_ids)
+
+        streams = self.read(
+            [(author_id, heads[author_id]) for author_id in author_ids], page_size + 1
+        )
+        merged = heapq.merge(*streams.values(), reverse=True)
+        rows = list(islice(merged, page_size))
+
+        consumed = Counter(author_id for _, _, author_id in rows)
+        next_heads = {
+            author_id: head
+            for author_id, head in heads.items()
+            if author_id not in streams
+        }
+        for author_id, stream in streams.items():
+            rest = stream[consumed[author_id] :]
+            if rest:
+                next_heads[author_id] = rest[0][:2]
+        tweet_ids = [pk for _, pk, _ in rows]
+        tweets = {
+            tweet["id"] if fields else tweet.pk: tweet
+            for tweet in tweet_queryset(Tweet.objects.filter(pk__in=tweet_ids), fields)
+        }
+        tweets = [tweets[pk] for pk in tweet_ids if pk in tweets]
+        if not next_heads:
+            return CursorPage(tweets, None)
+        positions = [
+            [author_id, created_at.isoformat(), pk]
+            for author_id, (created_at, pk) in sorted(next_heads.items())
+        ]
+        return CursorPage(tweets, encode_cursor({"p": positions}))
+
+    def read(self, heads, size):
+        # ユーザーごとに head (含む) から古い順に size 件の (created_at, id, user_id)
+        # SQLite の複合 SELECT の上限があるので TIMELINE_MERGE_BATCH_SIZE 人ずつに分ける
+        streams = {author_id: [] for author_id, _ in heads}
+        batch_size = settings.TIMELINE_MERGE_BATCH_SIZE
+        for start in range(0, len(heads), batch_size):
+            subqueries = []
+            params = []
+            for author_id, head in heads[start : start + batch_size]:
+                if head:
+                    created_at, pk = head
+                    created_at = connection.ops.adapt_datetimefield_value(created_at)
+                    subqueries.append(AUTHOR_TWEETS_SQL.format(bound=HEAD_BOUND_SQL))
+                    params += [author_id, created_at, created_at, created_at, pk, size]
+                else:
+                    subqueries.append(AUTHOR_TWEETS_SQL.format(bound=""))
+                    params += [author_id, size]
+            rows = (
+                Tweet.objects.filter(
+                    pk__in=RawSQL(" UNION ALL ".join(subqueries), params)
+                )
+                .order_by("user_id", "-created_at", "-id")
+                .values_list("created_at", "id", "user_id")
+            )
+            for row in rows:
+                streams[row[2]].append(row)
+        return streams
+
+    def decode(self, cursor):
+        data = decode_cursor(cursor)
+        to_python = Tweet._meta.get_field("created_at").to_python
+        heads = {}
+        try:
+            for author_id, created_at, pk in data["p"]:
+                created_at = to_python(created_at)
+                if created_at is None:
+                    raise InvalidCursor(cursor)
+                heads[int(author_id)] = (created_at, int(pk))
+        except (KeyError, TypeError, ValueError, ValidationError):
+            raise InvalidCursor(cursor)
+        return heads
+
+
+TIMELINE_ENGINES = {
+    "global": GlobalTimeline,
+    "fanout": FanoutTimeline,
+    "merge": MergeTimeline,
+}
+
+
+def get_timeline(user):
+    if not user.is_authenticated:
+        return GlobalTimeline()
+    return TIMELINE_ENGINES[settings.HOME_TIMELINE_ENGINE]()
@@ -1,12 +1,36 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import api, views
+
+if settings.ASYNC_VIEWS:
+    LikeView, UnlikeView = views.AsyncLikeView, views.AsyncUnlikeView
+else:
+    LikeView, UnlikeView = views.LikeView, views.UnlikeView
 
 app_name = "tweets"
 urlpatterns = [
     path("create/", views.TweetCreateView.as_view(), name="create"),
+    path("search/", views.TweetSearchView.as_view(), name="search"),
+    path("tags/<str:tag>/", views.HashTagView.as_view(), name="hashtag"),
+    path("mentions/<str:username>/", views.MentionView.as_view(), name="mention"),
     path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
-    path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
-    path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("<int:pk>/like/", LikeView.as_view(), name="like"),
+    path("<int:pk>/unlike/", UnlikeView.as_view(), name="unlike"),
+    path("likes/", views.LikeCountView.as_view(), name="like_counts"),
+    path("likes/batch/", views.LikeBatchView.as_view(), name="like_batch"),
+    path("api/timeline/", api.TimelineAPIView.as_view(), name="api_timeline"),
+    path("api/<int:pk>/", api.TweetAPIView.as_view(), name="api_detail"),
+    path(
+        "api/users/<str:username>/",
+        api.UserTweetsAPIView.as_view(),
+        name="api_user_tweets",
+    ),
 ]
+
+if settings.ASYNC_VIEWS:
+    # SSE は ASGI でしか流せないので、ASGI で動かすときだけ公開する
+    urlpatterns.append(
+        path("likes/stream/", views.LikeStreamView.as_view(), name="like_stream")
+    )
@@ -1,12 +1,37 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.db import transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Exists, OuterRef
 from django.views import View
-from django.views.generic import CreateView, DetailView, DeleteView
-from .models import Tweet, Like
+from django.views.generic import CreateView, DetailView, DeleteView, ListView
+from .models import HashTag, Mention, Tweet, Like
 from django.urls import reverse_lazy
-from django.http import JsonResponse
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404
 
+from mysite.http import conditional_json_response
+from mysite.mixins import AsyncLoginRequiredMixin, ConditionalGetMixin
+from mysite.pagination import CursorPaginator, InvalidCursor
+
+from . import entities, timeline
+from .buffer import like_buffer
+from .fragments import tweet_row_cache
 from .forms import TweetForm
+from .live import like_count_broker
+from .search import search_tweets
+
+User = get_user_model()
 
 
 class TweetCreateView(LoginRequiredMixin, CreateView):
@@ -16,23 +41,117 @@ class TweetCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        with transaction.atomic():
+            response = super().form_valid(form)
+            timeline.on_tweet_created(self.object)
+            entities.index_tweet(self.object)
+        return response
 
 
-class TweetDetailView(LoginRequiredMixin, DetailView):
+class TweetDetailView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     model = Tweet
     template_name = "tweets/tweet_detail.html"
-    queryset = Tweet.objects.select_related("user").prefetch_related("like_set")
+    queryset = Tweet.objects.select_related("user")
+
+    def get_validators(self):
+        row = (
+            Tweet.objects.filter(pk=self.kwargs["pk"])
+            .values_list(
+                "created_at", "like_count", "like_updated_at", "user__username"
+            )
+            .first()
+        )
+        if row is None:
+            raise Http404
+        created_at, like_count, like_updated_at, username = row
+        like_count = pending_like_count(self.kwargs["pk"], like_count)
+        # 閲覧者によって いいね済み表示や削除リンクが変わるので、閲覧者も含める
+        key = (self.kwargs["pk"], self.request.user.pk, like_count, username)
+        return key + (created_at, like_updated_at), like_updated_at or created_at
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["like_count"] = self.object.like_set.count()
-        context["like_list"] = Like.objects.filter(user=self.request.user).values_list(
-            "tweet", flat=True
+        context["like_count"] = self.object.like_count
+        context["like_list"] = Like.objects.liked_tweet_ids(
+            self.request.user, [self.object]
         )
         return context
 
 
+class TweetPageMixin:
+    # get_page() が返す CursorPage のツイートを、行キャッシュとカーソルつきで描画する
+    context_object_name = "tweet_list"
+
+    def get_page(self, cursor):
+        raise NotImplementedError
+
+    def get_queryset(self):
+        try:
+            self.page = self.get_page(self.request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["next_cursor"] = self.page.next_cursor
+        context["tweet_rows"] = tweet_row_cache.render(self.page.object_list)
+        context["like_list"] = Like.objects.liked_tweet_ids(
+            self.request.user, self.page.object_list
+        )
+        return context
+
+
+class TweetSearchView(TweetPageMixin, ListView):
+    template_name = "tweets/tweet_search.html"
+
+    def get_page(self, cursor):
+        self.query = self.request.GET.get("q", "").strip()
+        return search_tweets(self.query, cursor, settings.TIMELINE_PAGE_SIZE)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["query"] = self.query
+        return context
+
+
+def entity_page(queryset, cursor):
+    paginator = CursorPaginator(
+        queryset.select_related("tweet__user"),
+        ("-created_at", "-tweet_id"),
+        settings.TIMELINE_PAGE_SIZE,
+    )
+    page = paginator.page(cursor)
+    page.object_list = [entity.tweet for entity in page.object_list]
+    return page
+
+
+class HashTagView(TweetPageMixin, ListView):
+    template_name = "tweets/tweet_list.html"
+
+    def get_page(self, cursor):
+        self.tag = self.kwargs["tag"].casefold()
+        return entity_page(HashTag.objects.filter(tag=self.tag), cursor)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["heading"] = f"#{self.tag}"
+        return context
+
+
+class MentionView(TweetPageMixin, ListView):
+    template_name = "tweets/tweet_list.html"
+
+    def get_page(self, cursor):
+        self.mentioned = get_object_or_404(User, username=self.kwargs["username"])
+        return entity_page(Mention.objects.filter(user=self.mentioned), cursor)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["heading"] = f"@{self.mentioned.username}"
+        return context
+
+
 class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     template_name = "tweets/tweet_delete.html"
     model = Tweet
@@ -43,12 +162,61 @@ class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         return self.object.user == self.request.user
 
 
+def pending_like_count(tweet_pk, like_count):
+    if settings.LIKE_BUFFER_ENABLED:
+        return max(like_count + like_buffer.pending_delta(tweet_pk), 0)
+    return like_count
+
+
+def buffer_like(user, tweet, liked):
+    before = pending_like_count(tweet.pk, tweet.like_count)
+    like_buffer.add(user.pk, tweet.pk, liked)
+    like_count = pending_like_count(tweet.pk, tweet.like_count)
+    like_count_broker.publish(tweet.pk, like_count - before, like_count)
+    return like_count
+
+
+def update_like(user, tweet, liked):
+    if settings.LIKE_BUFFER_ENABLED:
+        return buffer_like(user, tweet, liked)
+    if liked:
+        changed = Like.objects.like(user, tweet)
+    else:
+        changed = Like.objects.unlike(user, tweet)
+    tweet.refresh_from_db(fields=["like_count"])
+    if changed:
+        like_count_broker.publish(tweet.pk, 1 if liked else -1, tweet.like_count)
+    return tweet.like_count
+
+
+async def aupdate_like(user, tweet, liked):
+    if settings.LIKE_BUFFER_ENABLED:
+        # 最初の操作では いいね 済みかを DB で確かめるので同期関数として実行する
+        return await sync_to_async(buffer_like)(user, tweet, liked)
+    # トランザクションは非同期 ORM では使えないので、書き込みだけ同期関数として実行する
+    if liked:
+        changed = await sync_to_async(Like.objects.like)(user, tweet)
+    else:
+        changed = await sync_to_async(Like.objects.unlike)(user, tweet)
+    await tweet.arefresh_from_db(fields=["like_count"])
+    if changed:
+        like_count_broker.publish(tweet.pk, 1 if liked else -1, tweet.like_count)
+    return tweet.like_count
+
+
+def tweet_pks_from_query(request, max_ids):
+    tweet_pks = {int(pk) for pk in request.GET.get("ids", "").split(",") if pk}
+    if len(tweet_pks) > max_ids:
+        raise ValueError
+    return tweet_pks
+
+
 class LikeView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
         user = self.request.user
         tweet = get_object_or_404(Tweet, pk=kwargs["pk"])
-        Like.objects.get_or_create(tweet=tweet, user=user)
-        context = {"like_count": tweet.like_set.count(), "tweet_pk": tweet.pk}
+        like_count = update_like(user, tweet, True)
+        context = {"like_count": like_count, "tweet_pk": tweet.pk}
 
         return JsonResponse(context)
 
@@ -57,7 +225,138 @@ class UnlikeView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
         user = self.request.user
         tweet = get_object_or_404(Tweet, pk=kwargs["pk"])
-        Like.objects.filter(user=user, tweet=tweet).delete()
-        context = {"like_count": tweet.like_set.count(), "tweet_pk": tweet.pk}
+        like_count = update_like(user, tweet, False)
+        context = {"like_count": like_count, "tweet_pk": tweet.pk}
 
         return JsonResponse(context)
+
+
+class AsyncLikeView(AsyncLoginRequiredMixin, View):
+    liked = True
+
+    async def post(self, request, *args, **kwargs):
+        user = self.request.user
+        try:
+            tweet = await Tweet.objects.aget(pk=kwargs["pk"])
+        except Tweet.DoesNotExist:
+            raise Http404
+        like_count = await aupdate_like(user, tweet, self.liked)
+        context = {"like_count": like_count, "tweet_pk": tweet.pk}
+
+        return JsonResponse(context)
+
+
+class AsyncUnlikeView(AsyncLikeView):
+    liked = False
+
+
+class LikeBatchView(LoginRequiredMixin, View):
+    max_operations = 100
+    actions = {"like": True, "unlike": False}
+
+    def post(self, request, *args, **kwargs):
+        try:
+            operations = json.loads(request.body)["operations"]
+            if len(operations) > self.max_operations:
+                raise ValueError
+            intents = {}
+            for operation in operations:
+                tweet_pk = int(operation["tweet_pk"])
+                intents[tweet_pk] = self.actions[operation["action"]]
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest()
+
+        user_pk = self.request.user.pk
+        if settings.LIKE_BUFFER_ENABLED:
+            before = {pk: like_buffer.pending_delta(pk) for pk in intents}
+            like_buffer.add_many(user_pk, intents)
+            deltas = {pk: like_buffer.pending_delta(pk) - before[pk] for pk in intents}
+        else:
+            likes = {pk for pk, liked in intents.items() if liked}
+            deltas = Like.objects.apply(
+                likes={(user_pk, pk) for pk in likes},
+                unlikes={(user_pk, pk) for pk in intents.keys() - likes},
+            )
+        tweets = [
+            {"tweet_pk": tweet_pk, "like_count": pending_like_count(tweet_pk, count)}
+            for tweet_pk, count in Tweet.objects.filter(pk__in=intents).values_list(
+                "pk", "like_count"
+            )
+        ]
+        for tweet in tweets:
+            like_count_broker.publish(
+                tweet["tweet_pk"], deltas.get(tweet["tweet_pk"], 0), tweet["like_count"]
+            )
+        context = {"tweets": tweets}
+
+        return JsonResponse(context)
+
+
+class LikeCountView(LoginRequiredMixin, View):
+    max_ids = 300
+
+    def get(self, request, *args, **kwargs):
+        try:
+            tweet_pks = tweet_pks_from_query(request, self.max_ids)
+        except ValueError:
+            return HttpResponseBadRequest()
+
+        liked = Like.objects.filter(user=self.request.user, tweet=OuterRef("pk"))
+        rows = (
+            Tweet.objects.filter(pk__in=tweet_pks)
+            .annotate(is_liked=Exists(liked))
+            .order_by("pk")
+            .values_list("pk", "like_count", "is_liked")
+        )
+        pending = {}
+        if settings.LIKE_BUFFER_ENABLED:
+            pending = like_buffer.pending_likes(self.request.user.pk, tweet_pks)
+        tweets = [
+            {
+                "tweet_pk": tweet_pk,
+                "like_count": pending_like_count(tweet_pk, like_count),
+                "is_liked": pending.get(tweet_pk, is_liked),
+            }
+            for tweet_pk, like_count, is_liked in rows
+        ]
+        context = {"tweets": tweets}
+
+        return conditional_json_response(request, context)
+
+
+class LikeStreamView(AsyncLoginRequiredMixin, View):
+    # Server-Sent Events でいいね数の増減を配信する(ASGI で動かす)
+    # 購読中は DB を読まず、LikeView などが publish した値だけを流す
+    max_ids = 300
+
+    async def get(self, request, *args, **kwargs):
+        # WSGI では終わらない非同期イテレーターを同期で読み切ろうとして止まるので断る
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(status=501)
+        try:
+            tweet_pks = tweet_pks_from_query(request, self.max_ids)
+        except ValueError:
+            return HttpResponseBadRequest()
+        if not tweet_pks:
+            return HttpResponseBadRequest()
+
+        response = StreamingHttpResponse(
+            self.stream(tweet_pks), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def stream(self, tweet_pks):
+        subscription = like_count_broker.subscribe(tweet_pks)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                updates = await subscription.next(settings.LIVE_LIKES_KEEPALIVE)
+                if updates:
+                    data = json.dumps(updates, separators=(",", ":"))
+                    yield f"event: likes\ndata: {data}\n\n"
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            like_count_broker.unsubscribe(subscription)